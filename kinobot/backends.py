@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# License: GPL
+# Author : Vitiko
+
+import logging
+import random
+import sqlite3
+import time
+from collections import OrderedDict
+
+import cv2
+
+try:
+    import av
+except ImportError:
+    av = None
+
+from kinobot import KINOBASE
+
+# Samples needed before a backend is ranked by its own numbers
+MIN_SAMPLES = 3
+MIN_SUCCESS_RATE = 0.9
+# Chance of trying an unmeasured backend first
+EXPLORE_RATE = 0.1
+# Order used for files without measurements
+DEFAULT_ORDER = ("opencv", "ffmpeg", "pyav")
+
+BACKENDS = OrderedDict()
+
+logger = logging.getLogger(__name__)
+
+
+def register_backend(name):
+    """
+    Register a frame extraction backend. Backends take a video path, a list
+    of (second, microsecond) tuples, a snap_ms value and a max_height value,
+    and return a list of cv2 image arrays (None for failed frames) no taller
+    than max_height.
+
+    :param name: backend name
+    """
+
+    def decorator(func):
+        BACKENDS[name] = func
+        return func
+
+    return decorator
+
+
+def get_scaled_size(width, height, max_height=None):
+    """
+    Return the (width, height) of a frame downscaled to max_height.
+
+    :param width: width
+    :param height: height
+    :param max_height: maximum height (None for no limit)
+    """
+    if not max_height or height <= max_height:
+        return width, height
+
+    return max(1, int(round(width * max_height / height))), max_height
+
+
+def downscale_frame(frame, max_height=None):
+    """
+    Downscale a decoded frame to max_height, right after decoding.
+
+    :param frame: cv2 image array (or None)
+    :param max_height: maximum height (None for no limit)
+    """
+    if frame is None:
+        return None
+
+    height, width = frame.shape[:2]
+    size = get_scaled_size(width, height, max_height)
+    if size == (width, height):
+        return frame
+
+    return cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+
+
+def get_backend_stats(path):
+    """
+    Return a dictionary of backend name -> (successes, failures, seconds)
+    for a video.
+
+    :param path: video path
+    """
+    with sqlite3.connect(KINOBASE) as conn:
+        try:
+            rows = conn.execute(
+                "select backend, successes, failures, seconds from "
+                "BACKEND_STATS where path=?",
+                (path,),
+            ).fetchall()
+        except sqlite3.OperationalError:
+            logger.info("BACKEND_STATS table not available")
+            return {}
+
+    return {row[0]: row[1:] for row in rows}
+
+
+def record_backend_stats(path, backend, successes, failures, seconds):
+    """
+    :param path: video path
+    :param backend: backend name
+    :param successes: extracted frames
+    :param failures: failed frames
+    :param seconds: elapsed time
+    """
+    with sqlite3.connect(KINOBASE) as conn:
+        try:
+            conn.execute(
+                "insert or ignore into BACKEND_STATS (path, backend) values (?,?)",
+                (path, backend),
+            )
+            conn.execute(
+                "update BACKEND_STATS set successes=successes+?, "
+                "failures=failures+?, seconds=seconds+? where path=? and backend=?",
+                (successes, failures, seconds, path, backend),
+            )
+            conn.commit()
+        except sqlite3.OperationalError as error:
+            logger.error(error)
+
+
+def get_default_position(name):
+    try:
+        return DEFAULT_ORDER.index(name)
+    except ValueError:
+        return len(DEFAULT_ORDER)
+
+
+def get_backend_order(path):
+    """
+    Sort the available backends for a video: reliable backends by mean
+    latency per frame, then unmeasured backends, then unreliable ones.
+
+    :param path: video path
+    """
+    stats = get_backend_stats(path)
+    good, unmeasured, bad = [], [], []
+
+    for name in sorted(BACKENDS, key=get_default_position):
+        successes, failures, seconds = stats.get(name, (0, 0, 0.0))
+        samples = successes + failures
+        if samples < MIN_SAMPLES:
+            unmeasured.append(name)
+        elif successes / samples < MIN_SUCCESS_RATE:
+            bad.append(name)
+        else:
+            good.append((seconds / samples, name))
+
+    order = [name for _, name in sorted(good)] + unmeasured + bad
+
+    if good and unmeasured and random.random() < EXPLORE_RATE:
+        explored = random.choice(unmeasured)
+        logger.info(f"Measuring backend: {explored}")
+        order.remove(explored)
+        order.insert(0, explored)
+
+    return order
+
+
+def extract_frames(path, timestamps, snap_ms=None, max_height=None):
+    """
+    Extract frames with the best backend for the video. Frames that fail
+    are retried with the next backend. Timing and success counts are
+    recorded for every backend used.
+
+    :param path: video path
+    :param timestamps: list of (second, microsecond) tuples
+    :param snap_ms: keyframe snapping tolerance in milliseconds
+    :param max_height: decode frames no taller than this (None for no limit)
+    """
+    frames = [None] * len(timestamps)
+
+    for name in get_backend_order(path):
+        missing = [index for index, frame in enumerate(frames) if frame is None]
+        if not missing:
+            break
+
+        logger.info(f"Using {name} backend for {len(missing)} frame(s)")
+        start = time.time()
+        try:
+            new_frames = BACKENDS[name](
+                path, [timestamps[index] for index in missing], snap_ms, max_height
+            )
+        except Exception as error:
+            logger.error(error, exc_info=True)
+            new_frames = [None] * len(missing)
+
+        elapsed = time.time() - start
+        successes = sum(frame is not None for frame in new_frames)
+        record_backend_stats(path, name, successes, len(missing) - successes, elapsed)
+
+        for index, frame in zip(missing, new_frames):
+            frames[index] = frame
+
+    return frames
+
+
+def extract_frame(path, second, microsecond=0, snap_ms=None, max_height=None):
+    """
+    Single frame version of extract_frames.
+
+    :param path: video path
+    :param second: second
+    :param microsecond: microsecond
+    :param snap_ms: keyframe snapping tolerance in milliseconds
+    :param max_height: decode frames no taller than this (None for no limit)
+    """
+    return extract_frames(path, [(second, microsecond)], snap_ms, max_height)[0]
+
+
+def get_frames_from_av(path, timestamps, snap_ms=None, max_height=None):
+    """
+    Extract frames with PyAV. Every target is decoded from its previous
+    keyframe; the first frame shown at or after the target is returned.
+
+    :param path: video path
+    :param timestamps: list of (second, microsecond) tuples
+    :param snap_ms: unused
+    :param max_height: maximum height (scaled by libswscale)
+    """
+    frames = []
+    with av.open(path) as container:
+        stream = container.streams.video[0]
+        stream.thread_type = "AUTO"
+        start_time = float((stream.start_time or 0) * stream.time_base)
+        width, height = get_scaled_size(
+            stream.codec_context.width, stream.codec_context.height, max_height
+        )
+
+        for second, microsecond in timestamps:
+            # Microseconds are counted twice (see kinobot.frame)
+            target = start_time + second + (microsecond * 0.000002)
+            container.seek(int(target / stream.time_base), stream=stream)
+
+            found = None
+            for frame in container.decode(stream):
+                if frame.time is not None and frame.time >= target:
+                    found = frame.to_ndarray(format="bgr24", width=width, height=height)
+                    break
+
+            frames.append(found)
+
+    return frames
+
+
+if av is not None:
+    register_backend("pyav")(get_frames_from_av)
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# License: GPL
+# Author : Vitiko
+
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+
+import numpy as np
+
+from kinobot import FRAMES_DIR
+
+CACHE_DIR = os.path.join(FRAMES_DIR, "cache")
+# Evicting down to this fraction avoids scanning the directory on every put
+EVICTION_TARGET = 0.9
+
+logger = logging.getLogger(__name__)
+
+
+class ArrayCache:
+    """
+    Size-bounded on-disk cache of NumPy arrays. Arrays are stored
+    uncompressed (.npy), as compressing a frame costs more than decoding
+    it again. Least recently used files are removed first (file mtimes are
+    refreshed on every hit).
+
+    :param name: cache name (subdirectory of CACHE_DIR)
+    :param max_size: maximum size in bytes
+    """
+
+    def __init__(self, name, max_size):
+        self.name = name
+        self.directory = os.path.join(CACHE_DIR, name)
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._size = None
+        self._lock = threading.Lock()
+
+    def get(self, key, mmap_mode=None):
+        """
+        Return an array or None.
+
+        :param key: hashable key (tuple of strings and numbers)
+        :param mmap_mode: numpy.load mmap_mode (for arrays that are copied
+        right away)
+        """
+        path = self._get_path(key)
+        try:
+            array = np.load(path, mmap_mode=mmap_mode)
+            os.utime(path)
+        except (OSError, ValueError, EOFError):  # missing or corrupted
+            self.misses += 1
+            logger.info(f"{self.name} cache miss ({self.hits}/{self.misses})")
+            return None
+
+        self.hits += 1
+        logger.info(f"{self.name} cache hit ({self.hits}/{self.misses})")
+        return array
+
+    def put(self, key, array):
+        """
+        :param key: hashable key (tuple of strings and numbers)
+        :param array: array to store
+        """
+        path = self._get_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # Write and rename so readers never see partial files
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "wb") as tmp_file:
+            np.save(tmp_file, array)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            if self._size is None:
+                self._size = sum(size for _, size, _ in self._scan())
+            else:
+                self._size += os.path.getsize(path)
+
+            if self._size > self.max_size:
+                self._evict()
+
+    def reset_lock(self):
+        """
+        Replace the lock (forked processes may inherit it locked).
+        """
+        self._lock = threading.Lock()
+
+    def _get_path(self, key):
+        digest = hashlib.sha1(repr(key).encode()).hexdigest()
+        return os.path.join(self.directory, digest[:2], digest + ".npy")
+
+    def _scan(self):
+        for root, _, files in os.walk(self.directory):
+            for file_ in files:
+                path = os.path.join(root, file_)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                yield path, stat.st_size, stat.st_mtime
+
+    def _evict(self):
+        files = sorted(self._scan(), key=lambda item: item[2])
+        self._size = sum(item[1] for item in files)
+        target = self.max_size * EVICTION_TARGET
+
+        for path, size, _ in files:
+            if self._size <= target:
+                break
+            try:
+                os.remove(path)
+                self._size -= size
+            except OSError:
+                pass
+
+        logger.info(f"{self.name} cache evicted to {self._size} bytes")
+
+
+# Decoded frames, keyed by file identity and frame number
+FRAME_CACHE = ArrayCache("frames", 2 * 1024**3)
+# Output of kinobot.frame.fix_frame (before quotes and palettes)
+FIXED_FRAME_CACHE = ArrayCache("fixed", 2 * 1024**3)
+
+os.register_at_fork(after_in_child=FRAME_CACHE.reset_lock)
+os.register_at_fork(after_in_child=FIXED_FRAME_CACHE.reset_lock)
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# License: GPL
+# Author : Vitiko
+
+import atexit
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import cv2
+
+MAX_CAPTURES = 4
+IDLE_TIMEOUT = 300
+
+logger = logging.getLogger(__name__)
+
+
+class CapturePool:
+    """
+    Process-wide pool of open cv2.VideoCapture handles keyed by video path.
+    Handles are evicted when the pool is full (least recently used first) or
+    when they have been idle for too long. Handles evicted while in use are
+    retired instead: the last user releases them.
+
+    :param max_size: maximum number of open handles
+    :param idle_timeout: seconds before an unused handle is released
+    """
+
+    def __init__(self, max_size=MAX_CAPTURES, idle_timeout=IDLE_TIMEOUT):
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self._captures = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._captures)
+
+    def __contains__(self, path):
+        return path in self._captures
+
+    @contextmanager
+    def acquire(self, path):
+        """
+        Yield an open capture for path. The handle is locked for the whole
+        block, so concurrent callers for the same file wait for each other.
+
+        :param path: video path
+        :raises OSError
+        """
+        entry = self._get_entry(path)
+
+        try:
+            with entry["lock"]:
+                try:
+                    yield entry["capture"]
+                except Exception:
+                    # The decoder state is unknown after a failure
+                    with self._lock:
+                        if self._captures.get(path) is entry:
+                            self._discard(path, self._captures.pop(path))
+                    raise
+                finally:
+                    entry["last_used"] = time.time()
+        finally:
+            with self._lock:
+                entry["users"] -= 1
+                if entry["retired"] and not entry["users"]:
+                    self._discard(path, entry)
+
+    def release(self, path=None):
+        """
+        Release a capture handle. Release everything if path is None.
+
+        :param path: video path
+        """
+        with self._lock:
+            paths = list(self._captures) if path is None else [path]
+            for path_ in paths:
+                entry = self._captures.pop(path_, None)
+                if entry is not None:
+                    self._discard(path_, entry)
+
+    def reset(self):
+        """
+        Forget every handle without releasing it. Forked processes call this,
+        as the inherited handles and locks belong to the parent.
+        """
+        self._captures = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get_entry(self, path):
+        with self._lock:
+            self._evict_idle()
+
+            entry = self._captures.get(path)
+            if entry is not None:
+                self._captures.move_to_end(path)
+                entry["users"] += 1
+                return entry
+
+            while len(self._captures) >= self.max_size:
+                old_path, old_entry = self._captures.popitem(last=False)
+                logger.info(f"Evicting capture: {old_path}")
+                self._discard(old_path, old_entry)
+
+            logger.info(f"Opening capture: {path}")
+            capture = cv2.VideoCapture(path)
+            if not capture.isOpened():
+                capture.release()
+                raise OSError(f"Unable to open video: {path}")
+
+            entry = {
+                "capture": capture,
+                "lock": threading.Lock(),
+                "last_used": time.time(),
+                "users": 1,
+                "retired": False,
+            }
+            self._captures[path] = entry
+            return entry
+
+    def _discard(self, path, entry):
+        # Called with self._lock held. Entries are already out of the pool.
+        if entry["users"]:
+            entry["retired"] = True
+            return
+
+        logger.info(f"Releasing capture: {path}")
+        entry["capture"].release()
+
+    def _evict_idle(self):
+        limit = time.time() - self.idle_timeout
+        for path in [
+            path_
+            for path_, entry in self._captures.items()
+            if entry["last_used"] < limit and not entry["users"]
+        ]:
+            logger.info(f"Releasing idle capture: {path}")
+            self._discard(path, self._captures.pop(path))
+
+
+CAPTURE_POOL = CapturePool()
+
+atexit.register(CAPTURE_POOL.release)
+os.register_at_fork(after_in_child=CAPTURE_POOL.reset)
@@ -19,7 +19,11 @@ import requests
 import tmdbsimple as tmdb
 
 import kinobot.exceptions as exceptions
-from kinobot.frame import get_dar
+from kinobot.frame import crop_box_to_str, detect_crop_box, get_dar
+from kinobot.keyframes import build_frame_index, insert_frame_index
+from kinobot.probe import get_file_identity
+from kinobot.quotes import update_quote_index
+from kinobot.subtitles import compile_subtitle, is_compiled
 from kinobot.utils import (
     kino_log,
     is_episode,
@@ -62,7 +66,7 @@ def create_db_tables():
                 TEXT NOT NULL, overview TEXT, popularity TEXT, budget TEXT,
                 source TEXT, imdb TEXT, runtime TEXT, requests INT,
                 last_request INT DEFAULT (0), dar REAL DEFAULT (0),
-                verified_subs BOOLEAN DEFAULT (0));
+                verified_subs BOOLEAN DEFAULT (0), crop TEXT);
                 """
             )
             logger.info("Table created: MOVIES")
@@ -77,7 +81,7 @@ def create_db_tables():
                 subtitle TEXT, source TEXT, id INT UNIQUE, overview TEXT,
                 requests INT DEFAULT (0), last_request INT DEFAULT (0),
                 dar REAL DEFAULT (0), verified_subs BOOLEAN DEFAULT (0),
-                runtime TEXT);
+                runtime TEXT, crop TEXT);
                 """
             )
             logger.info("Table created: EPISODES")
@@ -85,6 +89,69 @@ def create_db_tables():
         except sqlite3.OperationalError:
             pass
 
+        for table in ("MOVIES", "EPISODES"):
+            try:
+                conn.execute(f"ALTER TABLE {table} ADD COLUMN crop TEXT")
+                logger.info(f"Column added: {table}.crop")
+            except sqlite3.OperationalError:
+                pass
+
+        try:
+            conn.execute(
+                """CREATE TABLE QUOTE_SOURCES (id INTEGER PRIMARY KEY, subtitle
+                TEXT UNIQUE NOT NULL, item_type TEXT NOT NULL, item_id TEXT NOT
+                NULL, size INT, mtime INT);"""
+            )
+            logger.info("Table created: QUOTE_SOURCES")
+        except sqlite3.OperationalError:
+            pass
+
+        try:
+            conn.execute(
+                # FTS5 arguments can't be split across lines
+                "CREATE VIRTUAL TABLE QUOTES USING fts5(quote, "
+                "source UNINDEXED, idx UNINDEXED, start_ms UNINDEXED, "
+                "end_ms UNINDEXED, tokenize='unicode61 remove_diacritics 2');"
+            )
+            logger.info("Table created: QUOTES")
+        except sqlite3.OperationalError:
+            pass
+
+        try:
+            conn.execute(
+                """CREATE TABLE FRAME_INDEX (path TEXT UNIQUE NOT NULL,
+                pts BLOB NOT NULL, keyframes BLOB NOT NULL);"""
+            )
+            logger.info("Table created: FRAME_INDEX")
+        except sqlite3.OperationalError:
+            pass
+
+        for column in ("size", "mtime"):
+            try:
+                conn.execute(f"ALTER TABLE FRAME_INDEX ADD COLUMN {column} INT")
+                logger.info(f"Column added: FRAME_INDEX.{column}")
+            except sqlite3.OperationalError:
+                pass
+
+        try:
+            conn.execute(
+                """CREATE TABLE BACKEND_STATS (path TEXT NOT NULL, backend
+                TEXT NOT NULL, successes INT DEFAULT (0), failures INT
+                DEFAULT (0), seconds REAL DEFAULT (0), UNIQUE(path, backend));"""
+            )
+            logger.info("Table created: BACKEND_STATS")
+        except sqlite3.OperationalError:
+            pass
+
+        try:
+            conn.execute(
+                """CREATE TABLE PROBES (path TEXT UNIQUE NOT NULL, size INT,
+                mtime INT, data TEXT NOT NULL);"""
+            )
+            logger.info("Table created: PROBES")
+        except sqlite3.OperationalError:
+            pass
+
         try:
             conn.execute(
                 """CREATE TABLE USERS (name TEXT UNIQUE, requests INT
@@ -236,9 +303,9 @@ def update_runtime_from_table(table="movies"):
     """
     with sqlite3.connect(KINOBASE) as conn:
         paths = conn.execute(f"select path from {table} where runtime=0").fetchall()
-        logger.info(f"Files with missing DAR: {len(paths)}")
+        logger.info(f"Files with missing runtime: {len(paths)}")
         for path in paths:
-            runtime = get_video_length(path)
+            runtime = str(timedelta(seconds=get_video_length(path[0])))
             conn.execute(
                 f"update {table} set runtime=? where path=?",
                 (
@@ -249,6 +316,81 @@ def update_runtime_from_table(table="movies"):
             conn.commit()
 
 
+def update_frame_index_from_table(table="movies"):
+    """
+    Build the frame index of all files from table without one (or with the
+    index of a replaced file).
+
+    :param table
+    """
+    with sqlite3.connect(KINOBASE) as conn:
+        rows = conn.execute(
+            f"select m.path, f.size, f.mtime from {table} m left join "
+            "frame_index f on f.path = m.path"
+        ).fetchall()
+
+    paths = []
+    for path, size, mtime in rows:
+        try:
+            if get_file_identity(path) != (path, size, mtime):
+                paths.append(path)
+        except OSError:
+            continue
+
+    logger.info(f"Files without frame index: {len(paths)}")
+    for path in paths:
+        try:
+            insert_frame_index(path, build_frame_index(path))
+        except Exception as error:
+            logger.error(error, exc_info=True)
+
+
+def update_crop_from_table(table="movies"):
+    """
+    Detect the black borders of all files without a stored crop box from
+    table.
+
+    :param table
+    """
+    with sqlite3.connect(KINOBASE) as conn:
+        paths = conn.execute(f"select path from {table} where crop is null").fetchall()
+        logger.info(f"Files with missing crop box: {len(paths)}")
+        for path in paths:
+            try:
+                crop = crop_box_to_str(*detect_crop_box(path[0]))
+            except Exception as error:
+                logger.error(error, exc_info=True)
+                continue
+            if crop is None:
+                logger.info(f"No crop box found (retrying next time): {path[0]}")
+                continue
+            conn.execute(f"update {table} set crop=? where path=?", (crop, path[0]))
+            conn.commit()
+
+
+def update_compiled_subtitles(item_list):
+    """
+    Compile the subtitles of a list of movie/episode dictionaries without
+    an up-to-date compiled version.
+
+    :param item_list: list of movie/episode dictionaries
+    """
+    compiled = 0
+    for item in item_list:
+        if not item.get("subtitle"):
+            continue
+        try:
+            if not is_compiled(item["subtitle"]):
+                compile_subtitle(item["subtitle"])
+                compiled += 1
+        except FileNotFoundError:
+            continue
+        except Exception as error:
+            logger.error(error, exc_info=True)
+
+    logger.info(f"Compiled subtitles: {compiled}")
+
+
 def get_radarr_list():
     " Fetch list from Radarr server. "
     logger.info("Retrieving movie list from Radarr")
@@ -731,6 +873,7 @@ def get_list_of_episode_dicts():
                     "last_request": i[11],
                     "dar": i[12],
                     "runtime": i[14],
+                    "crop": i[-1],  # added last (see create_db_tables)
                 }
             )
         return dict_list
@@ -775,6 +918,7 @@ def get_list_of_movie_dicts():
                     "requests": i[17],
                     "last_request": i[18],
                     "dar": i[20],
+                    "crop": i[-1],  # added last (see create_db_tables)
                 }
             )
         return sorted(dict_list, key=itemgetter("title"))
@@ -796,6 +940,16 @@ def update_library():
     update_episode_table(episode_list)
     remove_empty()
     update_dar_from_table("episodes")
+    update_frame_index_from_table("movies")
+    update_frame_index_from_table("episodes")
+    update_crop_from_table("movies")
+    update_crop_from_table("episodes")
+    movie_list = get_list_of_movie_dicts()
+    episode_list = get_list_of_episode_dicts()
+    update_compiled_subtitles(movie_list)
+    update_compiled_subtitles(episode_list)
+    update_quote_index(movie_list, "movies")
+    update_quote_index(episode_list, "episodes")
 
 
 @click.command("posters")
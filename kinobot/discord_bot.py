@@ -15,6 +15,7 @@ from kinobot.exceptions import (
     OffensiveWord,
     InvalidRequest,
 )
+from kinobot.quotes import search_quotes
 from kinobot.request import search_episode, search_movie
 from kinobot.utils import (
     check_current_playing_plex,
@@ -67,6 +68,26 @@ def handle_discord_request(ctx, command, args):
         return "Duplicate request."
 
 
+def get_quote_description(quote_match):
+    """
+    :param quote_match: quotes.QuoteMatch object
+    """
+    if quote_match.item_type == "movies":
+        items = [i for i in MOVIE_LIST if str(i["tmdb"]) == quote_match.item_id]
+        title = f"{items[0]['title']} ({items[0]['year']})" if items else "?"
+    else:
+        items = [i for i in EPISODE_LIST if str(i["id"]) == quote_match.item_id]
+        title = (
+            f"{items[0]['title']} S{items[0]['season']:02}E{items[0]['episode']:02}"
+            if items
+            else "?"
+        )
+
+    minutes, seconds = divmod(quote_match.start // 1000, 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"**{title}** [{hours:02}:{minutes:02}:{seconds:02}] {quote_match.quote}"
+
+
 def handle_queue(queue, title):
     if queue:
         shuffle(queue)
@@ -170,6 +191,19 @@ async def search(ctx, *args):
     await ctx.send(message)
 
 
+@bot.command(name="quote", help="search a quote in the whole collection")
+async def quote(ctx, *args):
+    query = " ".join(args)
+    matches = search_quotes(query, 5)
+
+    if matches:
+        description = "\n".join(get_quote_description(match) for match in matches)
+        embed = Embed(title=f"Quotes for '{query}'", description=description)
+        return await ctx.send(embed=embed)
+
+    await ctx.send("apoco si pa")
+
+
 @bot.command(name="vs", help="verify subtitles")
 @commands.has_any_role("botmin", "subs moderator")
 async def verify_subs_(ctx):
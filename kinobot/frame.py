@@ -6,228 +6,396 @@
 import json
 import logging
 import os
+import re
 import subprocess
-import textwrap
+from collections import namedtuple
 
 import cv2
-import timeout_decorator
-from PIL import Image, ImageChops, ImageDraw, ImageFont, ImageStat
+import numpy as np
+from PIL import Image, ImageDraw
 from pymediainfo import MediaInfo
 
-from kinobot.palette import get_palette
-from kinobot.utils import clean_sub, check_offensive_content, wand_to_pil, pil_to_wand
+from kinobot.backends import (
+    downscale_frame,
+    extract_frames,
+    get_scaled_size,
+    register_backend,
+)
+from kinobot.cache import FIXED_FRAME_CACHE, FRAME_CACHE
+from kinobot.capture import CAPTURE_POOL
+from kinobot.keyframes import get_frame_index, locate_frame
+from kinobot.palette import get_palette, median_cut
+from kinobot.probe import get_file_identity, probe
+from kinobot.rendering import get_font, get_text_layout
+from kinobot.utils import clean_sub, check_offensive_content
+from kinobot.workers import RENDER_POOL
 from kinobot import FONTS
 
 FONT = os.path.join(FONTS, "helvetica.ttf")
+# Maximum characters per quote line
+QUOTE_WIDTH = 45
+# Decoding forward is cheaper than seeking for close frames
+MAX_FORWARD_SECONDS = 5
+# Bump this after any change to fix_frame so cached frames are invalidated
+PIPELINE_VERSION = 7
+# Facebook downsizes everything it receives, so taller sources are decoded
+# at reduced resolution
+MAX_HEIGHT = 1080
+# Render deadlines (seconds) for single frames and lists of frames
+FRAME_TIMEOUT = 15
+FRAMES_TIMEOUT = 60
+# Minute requests don't need exact frames
+MINUTE_SNAP_MS = 500
+# Frames sampled to find the black borders of a video
+CROP_SAMPLES = 8
+CROPDETECT_RE = re.compile(r"crop=(\d+):(\d+):(\d+):(\d+)")
+# Same values used with Wand's Image.trim: fuzz is in quantum units (the
+# QuantumRange of the usual Q16 builds of ImageMagick is 65535) and
+# percent_background is a fraction
+TRIM_FUZZ = 20.0
+TRIM_BACKGROUND = 0.2
+QUANTUM_RANGE = 65535
+# Frames wider than this are center cropped to WIDE_CROP of their width
+WIDE_QUOTIENT = 2.25
+WIDE_CROP = 0.8
+# Maximum width of the buffer used by analyze_frame
+ANALYSIS_WIDTH = 480
+# Palette engine of single frames (see kinobot.palette.COLOR_ENGINES)
+PALETTE_ENGINE = "numpy"
+
+FrameAnalysis = namedtuple("FrameAnalysis", ["bw", "palette_colors"])
+
 logger = logging.getLogger(__name__)
 
 
-def is_bw(pil_image):
+def get_trim_box(cv2_array, fuzz=TRIM_FUZZ, percent_background=TRIM_BACKGROUND):
     """
-    Guess if an image is B/W.
+    Find the (left, top, right, bottom) box kept by Wand's
+    Image.trim(color="black", fuzz=fuzz, percent_background=percent_background).
 
-    :param pil_image: PIL.Image object
+    Pixels within fuzz (RGB distance) of black are background. Like
+    ImageMagick with trim:percent-background, the edge with the fewest
+    content pixels is removed, one row or column at a time, while less than
+    1 - percent_background of its pixels are content. Return the full box
+    if the image is entirely black.
+
+    :param cv2_array: image array from cv2
+    :param fuzz: distance to black in quantum units (see QUANTUM_RANGE)
+    :param percent_background: tolerated fraction of background pixels
     """
-    hsv = ImageStat.Stat(pil_image.convert("HSV"))
-    return hsv.mean[1] < 35
+    height, width = cv2_array.shape[:2]
+    distance = fuzz / QUANTUM_RANGE * 255
+
+    # channels beyond the distance are content for sure
+    channel_limit = int(distance)
+    background = cv2.inRange(cv2_array, (0, 0, 0), (channel_limit,) * 3) > 0
+    if channel_limit:
+        rows, cols = np.nonzero(background)
+        near = cv2_array[rows, cols].astype(np.int32)
+        background[rows, cols] = (near * near).sum(axis=1) <= distance * distance
+
+    content = ~background
+    content_t = np.ascontiguousarray(content.T)
+
+    limit = min(max(1 - percent_background, np.finfo(float).eps), 1)
+    left, top, right, bottom = 0, 0, width, height
+    while left < right and top < bottom:
+        # same order as ImageMagick for ties
+        census = [
+            np.count_nonzero(content_t[left, top:bottom]) / (bottom - top),
+            np.count_nonzero(content_t[right - 1, top:bottom]) / (bottom - top),
+            np.count_nonzero(content[top, left:right]) / (right - left),
+            np.count_nonzero(content[bottom - 1, left:right]) / (right - left),
+        ]
+        lowest = min(census)
+        if lowest >= limit:
+            break
+
+        edge = census.index(lowest)
+        if edge == 0:
+            left += 1
+        elif edge == 1:
+            right -= 1
+        elif edge == 2:
+            top += 1
+        else:
+            bottom -= 1
+
+    if left >= right or top >= bottom:
+        return 0, 0, width, height
+
+    return left, top, right, bottom
 
 
-def fix_web_source(pil_image):
+def get_dar(path):
     """
-    Remove leftovers from trim() for web sources.
+    Get Display Aspect Ratio from file.
 
-    :param pil_image: PIL.Image object
+    :param path: path
     """
-    logger.info("Cropping WEB source")
-    width, height = pil_image.size
-    off = int(height * 0.01)
-
-    return pil_image.crop((0, off, width, height - off))
+    try:
+        logger.info("Using ffprobe")
+        display_aspect_ratio = probe(path)["dar"]
+    except:  # noqa
+        logger.info("ffprobe failed. Using mediainfo")
+        media_info = MediaInfo.parse(path, output="JSON")
+        display_aspect_ratio = float(
+            json.loads(media_info)["media"]["track"][1]["DisplayAspectRatio"]
+        )
+    logger.info(f"Extracted DAR: {display_aspect_ratio}")
+    return display_aspect_ratio
 
 
-def cv2_to_pil(cv2_array):
+def find_trim_box(cv2_array, display_aspect_ratio):
     """
-    Convert an array to a PIL.Image object.
+    Find the black borders of a decoded frame at full resolution. Return a
+    (left, top, right, bottom) tuple of fractions, or None if there are no
+    borders or the trim looks wrong.
 
     :param cv2_array: image array from cv2
+    :param display_aspect_ratio
     """
-    image = cv2.cvtColor(cv2_array, cv2.COLOR_BGR2RGB)
-    return Image.fromarray(image)
+    height, width = cv2_array.shape[:2]
+    left, top, right, bottom = get_trim_box(cv2_array)
+    trim_box = (left / width, top / height, right / width, bottom / height)
+    if trim_box == (0, 0, 1, 1):
+        return None
+
+    new_quotient = (
+        display_aspect_ratio * ((right - left) / width) / ((bottom - top) / height)
+    )
+    if abs(int(display_aspect_ratio * 100) - int(new_quotient * 100)) > 60:
+        logger.info("Possible bad trim found")
+        return None
 
+    logger.info(f"Black borders found: {trim_box}")
+    return trim_box
 
-def wand_trim(pil_image):
-    """
-    Trim black borders from an image with ImageMagick's algorithm. This method
-    seems to be more effective than PIL's ImageChops from pil_trim.
 
-    :param pil_image: PIL.Image object
+def analyze_frame(rgb_array, engine=PALETTE_ENGINE):
     """
-    wand_img = pil_to_wand(pil_image)
-    wand_img.trim(color="black", fuzz=20.0, percent_background=0.2)
-
-    return wand_to_pil(wand_img)
-
+    Analyze a fixed frame (see fix_frame) from a single downscaled buffer.
+    Return a FrameAnalysis with the B/W guess and the palette colors (median
+    cut). Palette colors are only computed for the numpy engine (None
+    otherwise), as the other engines need the full frame.
 
-def pil_trim(pil_image):
+    :param rgb_array: RGB image array
+    :param engine: palette engine from kinobot.palette.COLOR_ENGINES
     """
-    Trim black borders from an image.
+    height, width = rgb_array.shape[:2]
+    if width > ANALYSIS_WIDTH:
+        new_size = (ANALYSIS_WIDTH, max(1, int(height * ANALYSIS_WIDTH / width)))
+        small = cv2.resize(rgb_array, new_size, interpolation=cv2.INTER_AREA)
+    else:
+        small = rgb_array
 
-    :param pil_image: PIL.Image object
-    """
-    bg = Image.new(pil_image.mode, pil_image.size, pil_image.getpixel((0, 0)))
-    diff = ImageChops.difference(pil_image, bg)
-    diff = ImageChops.add(diff, diff)
-    bbox = diff.getbbox()
+    saturation = cv2.cvtColor(small, cv2.COLOR_RGB2HSV)[..., 1].mean()
 
-    if not bbox:
-        return pil_image
+    palette_colors = median_cut(small, 10) if engine == "numpy" else None
 
-    return pil_image.crop(bbox)
+    return FrameAnalysis(bw=bool(saturation < 35), palette_colors=palette_colors)
 
 
-def get_ffprobe_dar(path):
+def run_cropdetect(path, second):
     """
-    Get Display Aspect Ratio from ffprobe (Faster than MediaInfo but
-    not as reliable).
+    Get the (x, y, width, height) box suggested by ffmpeg's cropdetect filter
+    for a few frames starting at second. Return None if nothing is found.
 
     :param path: video path
+    :param second: second
+    :raises subprocess.TimeoutExpired
     """
     command = [
-        "ffprobe",
-        "-v",
-        "quiet",
-        "-print_format",
-        "json",
-        "-show_format",
-        "-show_streams",
+        "ffmpeg",
+        "-ss",
+        str(second),
+        "-i",
         path,
+        "-frames:v",
+        "3",
+        "-vf",
+        "cropdetect=limit=24:round=2:reset=0",
+        "-f",
+        "null",
+        "-",
     ]
-    result = subprocess.run(command, stdout=subprocess.PIPE, timeout=60)
-    return json.loads(result.stdout)["streams"][0]["display_aspect_ratio"].split(":")
+    result = subprocess.run(command, stderr=subprocess.PIPE, timeout=60)
+    found = CROPDETECT_RE.findall(result.stderr.decode(errors="ignore"))
+    if not found:
+        return None
 
+    width, height, x, y = (int(value) for value in found[-1])
+    return x, y, width, height
 
-def get_dar(path):
-    """
-    Get Display Aspect Ratio from file.
 
-    :param path: path
+def detect_crop_box(path, samples=CROP_SAMPLES):
     """
-    try:
-        logger.info("Using ffprobe")
-        d_width, d_height = get_ffprobe_dar(path)
-        display_aspect_ratio = float(d_width) / float(d_height)
-    except:  # noqa
-        logger.info("ffprobe failed. Using mediainfo")
-        media_info = MediaInfo.parse(path, output="JSON")
-        display_aspect_ratio = float(
-            json.loads(media_info)["media"]["track"][1]["DisplayAspectRatio"]
-        )
-    logger.info(f"Extracted DAR: {display_aspect_ratio}")
-    return display_aspect_ratio
+    Find the black borders of a video by sampling frames across its
+    duration. Return a (crop_box, stable) tuple, where crop_box is a
+    (left, top, right, bottom) tuple of fractions of the frame size (so it
+    works with scaled frames) and stable is False if the samples disagree
+    (e.g. changing aspect ratios).
 
+    Dark scenes make cropdetect suggest smaller boxes, so the union of all
+    the boxes is used.
 
-def center_crop_image(pil_image, square=False):
+    :param path: video path
+    :param samples: number of frames to sample
     """
-    Crop a image if is too wide as it doesn't look good on Facebook.
-    Very anti-kino, isn't it? But let's don't kill the reach.
+    info = probe(path)
+    width, height = info["width"], info["height"]
+    # Skip openings and credits
+    start, end = info["duration"] * 0.1, info["duration"] * 0.9
+    step = (end - start) / max(samples - 1, 1)
+
+    boxes = []
+    for sample in range(samples):
+        box = run_cropdetect(path, start + (step * sample))
+        if box is not None:
+            boxes.append(box)
+
+    if not boxes:
+        return None, False
+
+    left = min(box[0] for box in boxes)
+    top = min(box[1] for box in boxes)
+    right = max(box[0] + box[2] for box in boxes)
+    bottom = max(box[1] + box[3] for box in boxes)
+
+    # Agreement with the union within 1% of the frame size
+    tolerance = max(width, height) * 0.01
+    agreeing = [
+        box
+        for box in boxes
+        if abs(box[0] - left) <= tolerance
+        and abs(box[1] - top) <= tolerance
+        and abs(box[0] + box[2] - right) <= tolerance
+        and abs(box[1] + box[3] - bottom) <= tolerance
+    ]
+    stable = len(agreeing) * 2 >= len(boxes)
 
-    :param pil_image: PIL.Image object
-    :param square: trim extra borders from square frames
+    crop_box = (left / width, top / height, right / width, bottom / height)
+    logger.info(f"Detected crop box: {crop_box} (stable: {stable})")
+    return crop_box, stable
+
+
+def crop_box_to_str(crop_box, stable=True):
     """
-    width, height = pil_image.size
-    quotient = width / height
+    Serialize a crop box for the MOVIES/EPISODES tables. Return None (not
+    stored, so the detection is retried) if cropdetect found nothing.
 
-    if quotient <= 2.25 and not square:
-        return pil_image
+    :param crop_box: tuple from detect_crop_box
+    :param stable: stable bool from detect_crop_box
+    """
+    if crop_box is None:
+        return None
 
-    logger.info(f"Cropping too wide image ({quotient})")
-    new_width = width * 0.8
-    left = (width - new_width) / 2
-    right = (width + new_width) / 2
-    bottom = height
+    if not stable:
+        return "unstable"
 
-    return pil_image.crop((int(left), 0, int(right), bottom))
+    return ",".join(f"{value:.5f}" for value in crop_box)
 
 
-def trim(pil_image):
+def parse_crop_box(value):
     """
-    Remove black borders from WEB sources if present.
+    Parse a crop box from the MOVIES/EPISODES tables. Return None if the
+    box is missing or unstable.
 
-    :param pil_image: PIL.Image object
-    :raises exceptions.InconsistentImageSizes
+    :param value: string from crop_box_to_str
     """
-    og_w, og_h = pil_image.size
-    og_quotient = int((og_w / og_h) * 100)
+    try:
+        left, top, right, bottom = (float(item) for item in value.split(","))
+    except (AttributeError, ValueError):
+        return None
 
-    trim_ = wand_trim(pil_image)
-    new_w, new_h = trim_.size
-    new_quotient = int((new_w / new_h) * 100)
+    if not 0 <= left < right <= 1 or not 0 <= top < bottom <= 1:
+        return None
 
-    if abs(og_quotient - new_quotient) > 60:
-        logger.info("Possible bad trim found")
-        return pil_image
+    return left, top, right, bottom
 
-    if abs(og_w - new_w) > 5 or abs(og_h - new_h) > 5:
-        logger.info("The image was modified")
 
-    return trim_
+def get_target_rect(shape, display_aspect_ratio, crop_box=None):
+    """
+    Compute the geometry of a fixed frame: the (left, top, right, bottom)
+    source rectangle and the (width, height) output size. The output keeps
+    the source height and the DAR; the rectangle excludes black borders
+    and is center cropped if the result is too wide, as it doesn't look
+    good on Facebook. Very anti-kino, isn't it? But let's don't kill the
+    reach.
+
+    :param shape: shape of the cv2 image array
+    :param display_aspect_ratio
+    :param crop_box: (left, top, right, bottom) tuple of fractions
+    """
+    height, width = shape[:2]
+    left, top, right, bottom = crop_box or (0, 0, 1, 1)
+    left, right = int(round(left * width)), int(round(right * width))
+    top, bottom = int(round(top * height)), int(round(bottom * height))
+
+    # horizontal scale that fixes the DAR
+    scale_x = (height * display_aspect_ratio) / width
+    quotient = ((right - left) * scale_x) / (bottom - top)
+    if quotient > WIDE_QUOTIENT:
+        logger.info(f"Cropping too wide image ({quotient})")
+        offset = int((right - left) * (1 - WIDE_CROP) / 2)
+        left, right = left + offset, right - offset
+
+    size = (max(1, int((right - left) * scale_x)), bottom - top)
+    return (left, top, right, bottom), size
 
 
-def fix_frame(path, frame, check_palette=True, display_aspect_ratio=None):
+def fix_frame(path, frame, display_aspect_ratio=None, crop_box=None):
     """
-    Do all the needed fixes so the final frame looks really good.
+    Do all the needed fixes so the final frame looks really good. The DAR
+    fix, the black borders crop and the center crop are applied with a
+    single resample.
 
     :param path: video path
     :param frame: cv2 Image array
-    :param check_palette: check if the frame needs a palette
     :param display_aspect_ratio
+    :param crop_box: stored crop box from parse_crop_box. Black borders
+    are trimmed frame by frame if None
     """
-    logger.info(f"Fixing frame (check_palette: {check_palette})")
+    logger.info("Fixing frame")
 
     if not display_aspect_ratio:
         display_aspect_ratio = get_dar(path)
 
     logger.info(f"Found DAR: {display_aspect_ratio}")
-    # fix width
-    width, height, lay = frame.shape
-    logger.info(f"Original dimensions: {width}*{height}")
-    fixed_aspect = display_aspect_ratio / (width / height)
-    width = int(width * fixed_aspect)
-    # resize with fixed width (cv2)
-    logger.info(f"Fixed dimensions: {width}*{height}")
-    resized = cv2.resize(frame, (width, height))
-    # trim image if black borders are present. Convert to PIL first
-    pil_image = cv2_to_pil(resized)
+    trim_box = crop_box or find_trim_box(frame, display_aspect_ratio)
 
-    trim_image = trim(pil_image)
-
-    final_image = center_crop_image(trim_image)
-
-    if check_palette:
-        # return an extra bool if check_palette is True
-        return (final_image, not is_bw(final_image))
+    (left, top, right, bottom), size = get_target_rect(
+        frame.shape, display_aspect_ratio, trim_box
+    )
+    logger.info(f"Source rectangle: {(left, top, right, bottom)}; output: {size}")
+
+    fixed = frame[top:bottom, left:right]
+    if size != (right - left, bottom - top):
+        shrinking = size[0] * size[1] < fixed.shape[0] * fixed.shape[1]
+        interpolation = cv2.INTER_AREA if shrinking else cv2.INTER_LINEAR
+        fixed = cv2.resize(fixed, size, interpolation=interpolation)
+        # the resized array is ours, so convert it in place
+        cv2.cvtColor(fixed, cv2.COLOR_BGR2RGB, dst=fixed)
+    else:
+        fixed = cv2.cvtColor(fixed, cv2.COLOR_BGR2RGB)
 
-    return final_image
+    return Image.fromarray(fixed)
 
 
-def prettify_quote(text):
+def get_frame_number(fps, second, microsecond=0):
     """
-    Adjust line breaks to correctly draw a subtitle.
+    Convert a timestamp to a frame number. Microseconds are counted twice to
+    improve scene syncing with subtitles.
 
-    :param text: text
+    :param fps: frames per second
+    :param second: second
+    :param microsecond: microsecond
     """
-    lines = [" ".join(line.split()) for line in text.split("\n")]
-
-    if len(lines) == 1 and len(text) > 45:
-        return textwrap.fill(text, width=45)
-
-    if len(lines) > 2:
-        return textwrap.fill(" ".join(lines), width=45)
-
-    return "\n".join(lines)
+    extra_frames = int(fps * (microsecond * 0.000001)) * 2
+    return int(fps * second) + extra_frames
 
 
-def get_frame_from_movie(path, second, microsecond=0):
+def get_frame_from_movie(path, second, microsecond=0, snap_ms=None, max_height=None):
     """
     Get an image array based on seconds and microseconds. Microseconds are
     only used for frames with quotes to improve scene syncing.
@@ -235,50 +403,233 @@ def get_frame_from_movie(path, second, microsecond=0):
     :param path: video path
     :param second: second
     :param microsecond: microsecond
+    :param snap_ms: use the previous keyframe if it's within snap_ms (only
+    for indexed files)
+    :param max_height: maximum height
     """
-    logger.info("Extracting frame")
-    capture = cv2.VideoCapture(path)
-
-    fps = capture.get(cv2.CAP_PROP_FPS)
-
-    extra_frames = int(fps * (microsecond * 0.000001)) * 2
+    return get_frames_from_movie(path, [(second, microsecond)], snap_ms, max_height)[0]
 
-    frame_start = int(fps * second) + extra_frames
 
-    logger.info(f"Frame: {frame_start} (FPS: {fps}, extra frames: {extra_frames})")
-
-    capture.set(1, frame_start)
-    ret, frame = capture.read()
-
-    return frame
+@register_backend("opencv")
+def get_frames_from_movie(path, timestamps, snap_ms=None, max_height=None):
+    """
+    Get a list of image arrays from a list of (second, microsecond) tuples.
+    The targets are visited in order so the decoder only seeks when the next
+    frame is behind or too far ahead; close frames are decoded forward.
+    Frames are returned in request order.
 
+    If the file has a frame index (see kinobot.keyframes), the decoder seeks
+    to the keyframe preceding each target and counts decoded frames from
+    there, which is exact for variable frame rate sources. Otherwise, frame
+    numbers are guessed from the FPS.
 
-def extract_frame_ffmpeg(path, second):
+    :param path: video path
+    :param timestamps: list of (second, microsecond) tuples
+    :param snap_ms: use the previous keyframe if it's within snap_ms (only
+    for indexed files)
+    :param max_height: maximum height (frames are downscaled after decoding)
+    """
+    logger.info(f"Extracting {len(timestamps)} frame(s)")
+    frame_index = get_frame_index(path)
+    frames = [None] * len(timestamps)
+
+    with CAPTURE_POOL.acquire(path) as capture:
+        fps = capture.get(cv2.CAP_PROP_FPS)
+        max_forward = int(fps * MAX_FORWARD_SECONDS)
+
+        if frame_index is None:
+            targets = [
+                (get_frame_number(fps, *timestamp),) * 2 for timestamp in timestamps
+            ]
+        else:
+            targets = [
+                locate_frame(frame_index, *timestamp, snap_ms=snap_ms)
+                for timestamp in timestamps
+            ]
+
+        position = None
+        last_target, last_frame = None, None
+
+        for index in sorted(range(len(targets)), key=targets.__getitem__):
+            target, keyframe = targets[index]
+            if target == last_target:
+                frames[index] = last_frame
+                continue
+
+            if position is None or not 0 <= target - position <= max_forward:
+                logger.info(f"Frame: {target} (FPS: {fps}; seek point: {keyframe})")
+                if frame_index is None:
+                    capture.set(1, keyframe)
+                else:
+                    # OpenCV numbers frames by timestamp and average FPS
+                    capture.set(1, round(frame_index.pts[keyframe] * 0.000001 * fps))
+                position = keyframe
+
+            while position < target:
+                capture.grab()
+                position += 1
+
+            ret, frame = capture.read()
+            position += 1
+
+            if not ret:
+                # Force a seek for the next target
+                position = None
+
+            frames[index] = last_frame = downscale_frame(frame, max_height)
+            last_target = target
+
+    if not any(frame is not None for frame in frames):
+        # Don't keep a handle that failed to decode
+        CAPTURE_POOL.release(path)
+
+    return frames
+
+
+def extract_frame_ffmpeg(path, second, max_height=None):
     """
-    Get image array using ffmpeg. Useful when OpenCV fails.
+    Get image array using ffmpeg. Useful when OpenCV fails. Raw BGR frames
+    are piped from ffmpeg, so nothing touches the disk and several
+    extractions can run at the same time.
 
     :param path: video path
     :param second: second
+    :param max_height: maximum height (scaled by ffmpeg)
+    :raises subprocess.TimeoutExpired
     """
     logger.info("Extracting frame with ffmpeg")
-    tmp_image = "/tmp/tmp_pil.png"
+    info = probe(path)
+    # Stored geometry, like every other backend (fix_frame applies the DAR)
+    width, height = get_scaled_size(info["width"], info["height"], max_height)
+
     command = [
         "ffmpeg",
+        "-v",
+        "quiet",
         "-ss",
         str(second),
         "-copyts",
         "-i",
         path,
         "-vf",
-        "scale=iw*sar:ih",
+        f"scale={width}:{height}",
         "-vframes",
         "1",
-        tmp_image,
+        "-f",
+        "rawvideo",
+        "-pix_fmt",
+        "bgr24",
+        "pipe:1",
+    ]
+    result = subprocess.run(command, stdout=subprocess.PIPE, timeout=60)
+
+    frame_size = width * height * 3
+    if len(result.stdout) < frame_size:
+        logger.info(f"ffmpeg returned {len(result.stdout)}/{frame_size} bytes")
+        return None
+
+    frame = np.frombuffer(result.stdout, dtype=np.uint8, count=frame_size)
+    return frame.reshape((height, width, 3))
+
+
+@register_backend("ffmpeg")
+def get_frames_from_ffmpeg(path, timestamps, snap_ms=None, max_height=None):
+    """
+    Backend version of extract_frame_ffmpeg. Microseconds are counted twice
+    to match get_frame_number.
+
+    :param path: video path
+    :param timestamps: list of (second, microsecond) tuples
+    :param snap_ms: unused
+    :param max_height: maximum height
+    """
+    return [
+        extract_frame_ffmpeg(path, second + (microsecond * 0.000002), max_height)
+        for second, microsecond in timestamps
     ]
-    subprocess.run(command, stdout=subprocess.PIPE)
-    new_image = cv2.imread(tmp_image)
-    os.remove(tmp_image)
-    return new_image
+
+
+def get_frame_numbers(path, timestamps, snap_ms=None):
+    """
+    Get the frame numbers of a list of (second, microsecond) tuples,
+    independently of the extraction backend.
+
+    :param path: video path
+    :param timestamps: list of (second, microsecond) tuples
+    :param snap_ms: keyframe snapping tolerance in milliseconds
+    """
+    frame_index = get_frame_index(path)
+    if frame_index is not None:
+        return [
+            locate_frame(frame_index, *timestamp, snap_ms=snap_ms)[0]
+            for timestamp in timestamps
+        ]
+
+    fps = probe(path)["fps"]
+    return [get_frame_number(fps, *timestamp) for timestamp in timestamps]
+
+
+def get_frame_keys(path, timestamps, snap_ms=None, max_height=None):
+    """
+    Get (file identity, frame number, (width, height)) cache keys for a list
+    of (second, microsecond) tuples. Return None if the file can't be
+    identified. Every backend returns frames with the stored geometry of
+    the video (see kinobot.backends.get_scaled_size), so frames are
+    interchangeable between backends.
+
+    :param path: video path
+    :param timestamps: list of (second, microsecond) tuples
+    :param snap_ms: keyframe snapping tolerance in milliseconds
+    :param max_height: maximum height
+    """
+    try:
+        identity = get_file_identity(path)
+        info = probe(path)
+        size = get_scaled_size(info["width"], info["height"], max_height)
+        return [
+            (identity, number, size)
+            for number in get_frame_numbers(path, timestamps, snap_ms)
+        ]
+    except Exception as error:
+        logger.error(error)
+        return None
+
+
+def get_frames(path, timestamps, snap_ms=None, max_height=MAX_HEIGHT):
+    """
+    Get a list of image arrays from a list of (second, microsecond) tuples.
+    Decoded frames are cached by file identity, frame number and output
+    size, so only frames never seen before are extracted.
+
+    :param path: video path
+    :param timestamps: list of (second, microsecond) tuples
+    :param snap_ms: keyframe snapping tolerance in milliseconds
+    :param max_height: maximum height (None for the source resolution)
+    """
+    keys = get_frame_keys(path, timestamps, snap_ms, max_height)
+    if keys is None:
+        return extract_frames(path, timestamps, snap_ms, max_height)
+
+    frames = [FRAME_CACHE.get(key) for key in keys]
+
+    missing = [index for index, frame in enumerate(frames) if frame is None]
+    if not missing:
+        return frames
+
+    new_frames = extract_frames(
+        path, [timestamps[index] for index in missing], snap_ms, max_height
+    )
+    for index, frame in zip(missing, new_frames):
+        frames[index] = frame
+        # (width, height) of the key
+        if frame is None or frame.shape[1::-1] != keys[index][2]:
+            continue
+        try:
+            FRAME_CACHE.put(keys[index], frame)
+        except OSError as error:
+            logger.error(error)
+
+    return frames
 
 
 def draw_quote(pil_image, quote):
@@ -291,16 +642,17 @@ def draw_quote(pil_image, quote):
     logger.info("Drawing subtitle")
 
     check_offensive_content(quote)
-    quote = prettify_quote(clean_sub(quote))
 
     draw = ImageDraw.Draw(pil_image)
 
     width, height = pil_image.size
     font_size = int((width * 0.019) + (height * 0.019))
-    font = ImageFont.truetype(FONT, font_size)
+    font = get_font(FONT, font_size)
     # 0.067
     off = width * 0.08
-    txt_w, txt_h = draw.textsize(quote, font)
+    layout = get_text_layout(clean_sub(quote), FONT, font_size, QUOTE_WIDTH)
+    quote = layout.text
+    txt_w, txt_h = layout.size
 
     stroke = int(width * 0.0025)
 
@@ -317,14 +669,96 @@ def draw_quote(pil_image, quote):
     return pil_image
 
 
-@timeout_decorator.timeout(15, use_signals=False)
-def get_final_frame(
+def get_fixed_frames(
+    path,
+    timestamps,
+    display_aspect_ratio=None,
+    snap_ms=None,
+    crop_box=None,
+    max_height=MAX_HEIGHT,
+):
+    """
+    Get a list of PIL.Image objects from fix_frame. Results are cached by
+    file identity, frame number, output size, DAR, crop box and
+    PIPELINE_VERSION, so the same moment is only fixed once.
+
+    :param path: video path
+    :param timestamps: list of (second, microsecond) tuples
+    :param display_aspect_ratio
+    :param snap_ms: keyframe snapping tolerance in milliseconds
+    :param crop_box: stored crop box from parse_crop_box
+    :param max_height: maximum height of the decoded frames
+    """
+    if not display_aspect_ratio:
+        display_aspect_ratio = get_dar(path)
+
+    keys = get_frame_keys(path, timestamps, snap_ms, max_height)
+    if keys is not None:
+        keys = [
+            key + (round(display_aspect_ratio, 4), crop_box, PIPELINE_VERSION)
+            for key in keys
+        ]
+        # Image.fromarray copies them
+        cached_items = [FIXED_FRAME_CACHE.get(key, "r") for key in keys]
+    else:
+        cached_items = [None] * len(timestamps)
+
+    fixed = [
+        None if cached is None else Image.fromarray(cached) for cached in cached_items
+    ]
+
+    missing = [index for index, item in enumerate(fixed) if item is None]
+    if not missing:
+        return fixed
+
+    cv2_objs = get_frames(
+        path, [timestamps[index] for index in missing], snap_ms, max_height
+    )
+    for index, cv2_obj in zip(missing, cv2_objs):
+        image = fix_frame(path, cv2_obj, display_aspect_ratio, crop_box)
+        fixed[index] = image
+        if keys is None:
+            continue
+        try:
+            FIXED_FRAME_CACHE.put(keys[index], np.asarray(image))
+        except OSError as error:
+            logger.error(error)
+
+    return fixed
+
+
+def post_process_frame(pil_image, subtitle=None, multiple=False, ignore_quote=False):
+    """
+    Draw the quote of a fixed frame and append a palette if needed. The
+    frame is only analyzed (see analyze_frame) for palettes.
+
+    :param pil_image: PIL.Image object from fix_frame
+    :param subtitle: subtitle dictionary from subs module
+    :param multiple (bool)
+    :param ignore_quote
+    :raises exceptions.OffensiveWord
+    """
+    # colors of the frame, not of the quote
+    analysis = None if multiple else analyze_frame(np.asarray(pil_image))
+
+    if subtitle and not ignore_quote:
+        pil_image = draw_quote(pil_image, subtitle["message"])
+
+    if multiple or analysis.bw:
+        return pil_image
+
+    return get_palette(pil_image, engine=PALETTE_ENGINE, analysis=analysis)
+
+
+def render_final_frame(
     path,
     second=None,
     subtitle=None,
     multiple=False,
     display_aspect_ratio=None,
     ignore_quote=False,
+    crop_box=None,
+    max_height=MAX_HEIGHT,
 ):
     """
     Get a frame from seconds or subtitles, all with a lot of post-processing
@@ -337,19 +771,140 @@ def get_final_frame(
     :param multiple (bool)
     :param display_aspect_ratio
     :param ignore_quote
+    :param crop_box: stored crop box from parse_crop_box
+    :param max_height: output resolution; frames are decoded no taller than
+    this (None for the source resolution)
     :raises exceptions.OffensiveWord
-    :raises timeout_decorator.TimeoutError
     """
     if subtitle:
-        cv2_obj = get_frame_from_movie(path, subtitle["start"], subtitle["start_m"])
-        the_pil, palette_needed = fix_frame(path, cv2_obj, True, display_aspect_ratio)
-        if not ignore_quote:
-            the_pil = draw_quote(the_pil, subtitle["message"])
+        the_pil = get_fixed_frames(
+            path,
+            [(subtitle["start"], subtitle["start_m"])],
+            display_aspect_ratio,
+            crop_box=crop_box,
+            max_height=max_height,
+        )[0]
     else:
-        cv2_obj = get_frame_from_movie(path, int(second), microsecond=0)
-        the_pil, palette_needed = fix_frame(path, cv2_obj, True, display_aspect_ratio)
+        the_pil = get_fixed_frames(
+            path,
+            [(int(second), 0)],
+            display_aspect_ratio,
+            MINUTE_SNAP_MS,
+            crop_box,
+            max_height,
+        )[0]
 
-    if multiple:
-        return the_pil
+    return post_process_frame(the_pil, subtitle, multiple, ignore_quote)
 
-    return get_palette(the_pil) if palette_needed else the_pil
+
+def render_final_frames(
+    path,
+    subtitles,
+    multiple=True,
+    display_aspect_ratio=None,
+    crop_box=None,
+    max_height=MAX_HEIGHT,
+):
+    """
+    Get a list of frames from a list of subtitles of the same video. The
+    frames are extracted in a single pass and returned in request order.
+
+    :param path: video path
+    :param subtitles: list of subtitle dictionaries from subs module
+    :param multiple (bool)
+    :param display_aspect_ratio
+    :param crop_box: stored crop box from parse_crop_box
+    :param max_height: output resolution (see render_final_frame)
+    :raises exceptions.OffensiveWord
+    """
+    fixed = get_fixed_frames(
+        path,
+        [(subtitle["start"], subtitle["start_m"]) for subtitle in subtitles],
+        display_aspect_ratio,
+        crop_box=crop_box,
+        max_height=max_height,
+    )
+
+    return [
+        post_process_frame(the_pil, subtitle, multiple)
+        for the_pil, subtitle in zip(fixed, subtitles)
+    ]
+
+
+def get_final_frame(*args, **kwargs):
+    """
+    Run render_final_frame in a render worker, killing it after
+    FRAME_TIMEOUT seconds.
+
+    :raises exceptions.OffensiveWord
+    :raises timeout_decorator.TimeoutError
+    """
+    return RENDER_POOL.run(render_final_frame, args, kwargs, FRAME_TIMEOUT)
+
+
+def submit_final_frame(*args, **kwargs):
+    """
+    Non-blocking version of get_final_frame. Return a
+    concurrent.futures.Future.
+    """
+    return RENDER_POOL.submit(render_final_frame, args, kwargs, FRAME_TIMEOUT)
+
+
+def cache_fixed_frames(*args, **kwargs):
+    """
+    Run get_fixed_frames only to fill FIXED_FRAME_CACHE (nothing is
+    returned to the parent process).
+    """
+    get_fixed_frames(*args, **kwargs)
+
+
+def submit_final_frames(
+    path,
+    subtitles,
+    multiple=True,
+    display_aspect_ratio=None,
+    crop_box=None,
+    max_height=MAX_HEIGHT,
+):
+    """
+    Non-blocking version of get_final_frames. The frames are decoded and
+    fixed in a single pass by one worker; then every frame is rendered from
+    FIXED_FRAME_CACHE by its own worker. Return a list of
+    concurrent.futures.Future objects (one per subtitle, in order).
+
+    :param path: video path
+    :param subtitles: list of subtitle dictionaries from subs module
+    :param multiple (bool)
+    :param display_aspect_ratio
+    :param crop_box: stored crop box from parse_crop_box
+    :param max_height: output resolution (see render_final_frame)
+    """
+    timestamps = [(subtitle["start"], subtitle["start_m"]) for subtitle in subtitles]
+    decoded = RENDER_POOL.submit(
+        cache_fixed_frames,
+        (path, timestamps, display_aspect_ratio),
+        {"crop_box": crop_box, "max_height": max_height},
+        FRAMES_TIMEOUT,
+    )
+
+    return [
+        RENDER_POOL.submit_after(
+            decoded,
+            render_final_frame,
+            (path, None, subtitle, multiple, display_aspect_ratio),
+            {"crop_box": crop_box, "max_height": max_height},
+            FRAME_TIMEOUT,
+        )
+        for subtitle in subtitles
+    ]
+
+
+def get_final_frames(*args, **kwargs):
+    """
+    Run render_final_frames in a render worker, killing it after
+    FRAMES_TIMEOUT seconds.
+
+    :raises exceptions.OffensiveWord
+    :raises timeout_decorator.TimeoutError
+    """
+    return RENDER_POOL.run(render_final_frames, args, kwargs, FRAMES_TIMEOUT)
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# License: GPL
+# Author : Vitiko
+
+import logging
+import sqlite3
+import subprocess
+from collections import namedtuple
+from functools import lru_cache
+
+import numpy as np
+
+from kinobot.probe import get_file_identity
+
+from kinobot import KINOBASE
+
+FrameIndex = namedtuple("FrameIndex", ["pts", "keyframes"])
+
+logger = logging.getLogger(__name__)
+
+
+def build_frame_index(path):
+    """
+    Build a FrameIndex from the packets of the first video stream. Packets
+    are read without decoding, so this is fast even for long files.
+
+    FrameIndex.pts contains the presentation timestamps (microseconds,
+    relative to the first frame) in presentation order; FrameIndex.keyframes
+    contains the frame numbers of every keyframe.
+
+    :param path: video path
+    :raises subprocess.TimeoutExpired
+    """
+    logger.info(f"Building frame index: {path}")
+    command = [
+        "ffprobe",
+        "-v",
+        "error",
+        "-select_streams",
+        "v:0",
+        "-show_entries",
+        "packet=pts_time,flags",
+        "-of",
+        "csv=print_section=0",
+        path,
+    ]
+    result = subprocess.run(command, stdout=subprocess.PIPE, timeout=600)
+
+    packets = []
+    for line in result.stdout.decode().splitlines():
+        try:
+            pts_time, flags = line.split(",")[:2]
+            packets.append((float(pts_time), flags.startswith("K")))
+        except ValueError:  # N/A timestamps
+            continue
+
+    if not packets:
+        raise ValueError(f"No video packets found: {path}")
+
+    # Packets come in decoding order
+    packets.sort()
+    pts = np.array([packet[0] for packet in packets])
+    pts = np.round((pts - pts[0]) * 1000000).astype(np.int64)
+    keyframes = np.array(
+        [number for number, packet in enumerate(packets) if packet[1]] or [0],
+        dtype=np.int64,
+    )
+
+    logger.info(f"Indexed {len(pts)} frames ({len(keyframes)} keyframes)")
+    return FrameIndex(pts, keyframes)
+
+
+def insert_frame_index(path, frame_index):
+    """
+    :param path: video path
+    :param frame_index: FrameIndex object
+    :raises OSError
+    """
+    _, size, mtime = get_file_identity(path)
+    with sqlite3.connect(KINOBASE) as conn:
+        conn.execute(
+            "insert or replace into FRAME_INDEX (path, pts, keyframes, size, mtime) "
+            "values (?,?,?,?,?)",
+            (
+                path,
+                frame_index.pts.tobytes(),
+                frame_index.keyframes.tobytes(),
+                size,
+                mtime,
+            ),
+        )
+        conn.commit()
+
+
+@lru_cache(maxsize=16)
+def _load_frame_index(identity):
+    # Misses raise LookupError, so they are never cached
+    with sqlite3.connect(KINOBASE) as conn:
+        try:
+            row = conn.execute(
+                "select pts, keyframes from FRAME_INDEX where path=? and size=? "
+                "and mtime=?",
+                identity,
+            ).fetchone()
+        except sqlite3.OperationalError:
+            raise LookupError("FRAME_INDEX table not available") from None
+
+    if row is None:
+        raise LookupError(f"File not indexed: {identity[0]}")
+
+    return FrameIndex(
+        np.frombuffer(row[0], dtype=np.int64), np.frombuffer(row[1], dtype=np.int64)
+    )
+
+
+def get_frame_index(path):
+    """
+    Load the stored FrameIndex of a video. Return None if the file is not
+    indexed yet (or the index belongs to a replaced file).
+
+    :param path: video path
+    """
+    try:
+        return _load_frame_index(get_file_identity(path))
+    except (LookupError, OSError) as error:
+        logger.info(error)
+        return None
+
+
+def locate_frame(frame_index, second, microsecond=0, snap_ms=None):
+    """
+    Find the frame shown at a timestamp and its nearest preceding keyframe.
+    Microseconds are counted twice, just like kinobot.frame.get_frame_number.
+    If snap_ms is set and the keyframe is at most snap_ms milliseconds
+    before the frame, the keyframe is used instead (no decoding after the
+    seek).
+
+    Return a (frame, keyframe) tuple of frame numbers.
+
+    :param frame_index: FrameIndex object
+    :param second: second
+    :param microsecond: microsecond
+    :param snap_ms: keyframe snapping tolerance in milliseconds
+    """
+    timestamp = int(second * 1000000) + (microsecond * 2)
+
+    frame = max(int(np.searchsorted(frame_index.pts, timestamp, "right")) - 1, 0)
+    keyframe_pos = int(np.searchsorted(frame_index.keyframes, frame, "right")) - 1
+    # The start of the file is always a valid seek point
+    keyframe = int(frame_index.keyframes[keyframe_pos]) if keyframe_pos >= 0 else 0
+
+    if snap_ms is not None:
+        distance = frame_index.pts[frame] - frame_index.pts[keyframe]
+        if distance <= snap_ms * 1000:
+            logger.info(f"Snapping frame {frame} to keyframe {keyframe}")
+            frame = keyframe
+
+    return frame, keyframe
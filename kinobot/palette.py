@@ -5,12 +5,11 @@
 
 import logging
 
-from operator import itemgetter
-
+import numpy as np
 from PIL import Image, ImageOps
-from colorthief import ColorThief
 
-from kinobot.utils import wand_to_pil, pil_to_wand
+# Pixels sampled by the numpy engine (about 400x400)
+NUMPY_MAX_PIXELS = 160000
 
 logger = logging.getLogger(__name__)
 
@@ -20,6 +19,9 @@ def get_colors(image, dither="floyd_steinberg"):
     :param image: PIL.Image object
     :param dither: dither method from wand.image.DITHER_METHODS (version => 7)
     """
+    # kinobot.utils (and Wand) are only needed by this engine
+    from kinobot.utils import pil_to_wand, wand_to_pil
+
     logger.info("Extracting colors")
     magick = pil_to_wand(image)
 
@@ -32,54 +34,140 @@ def get_colors(image, dither="floyd_steinberg"):
     return list(pil_pixels.getdata())
 
 
+def median_cut(pixels, count=10):
+    """
+    Median cut color quantization. Return a list of RGB tuples sorted by
+    luminance (dark first) like the ones from ImageMagick's unique_colors.
+
+    :param pixels: RGB array with (..., 3) shape
+    :param count: number of colors
+    """
+    # channel-major boxes make the reductions contiguous
+    boxes = [np.ascontiguousarray(pixels.reshape(-1, 3).T)]
+    ranges = [np.ptp(boxes[0], axis=1)]
+
+    while len(boxes) < count:
+        index = max(range(len(boxes)), key=lambda i: ranges[i].max())
+        if ranges[index].max() == 0:
+            break
+
+        # split the widest box by the median of its widest channel
+        box = boxes.pop(index)
+        channel = ranges.pop(index).argmax()
+        half = box.shape[1] // 2
+        order = np.argpartition(box[channel], half)
+        new_boxes = [box.take(order[:half], axis=1), box.take(order[half:], axis=1)]
+        boxes[index:index] = new_boxes
+        ranges[index:index] = [np.ptp(new_box, axis=1) for new_box in new_boxes]
+
+    colors = np.array([box.mean(axis=1) for box in boxes]).round().astype(int)
+    colors = colors[np.argsort(colors @ (0.299, 0.587, 0.114), kind="stable")]
+
+    return [tuple(color) for color in colors.tolist()]
+
+
+def get_colors_numpy(image, count=10, max_pixels=NUMPY_MAX_PIXELS):
+    """
+    Median cut color extractor. The image is downsampled with a plain
+    stride, so the result is deterministic.
+
+    :param image: PIL.Image object
+    :param count: number of colors
+    :param max_pixels: maximum number of sampled pixels
+    """
+    logger.info("Extracting colors (numpy)")
+    pixels = np.asarray(image.convert("RGB"))
+    step = max(1, int((pixels.shape[0] * pixels.shape[1] / max_pixels) ** 0.5))
+
+    return median_cut(pixels[::step, ::step], count)
+
+
 def get_most_diff(saved_colors, new_colors):
     """
+    Get the candidate whose red channel differs (by more than 10) from the
+    most saved colors. Ties go to the most common candidate.
+
     :param saved_colors: list of previous colors
-    :param new_colors: list of colors from slice
+    :param new_colors: array of candidate colors from slice (most common
+    first)
     """
-    colors = []
-    for new in new_colors:
-        hits = 0
-        for saved in saved_colors:
-            if abs(new[0] - saved[0]) > 10:
-                hits += 1
-        colors.append({"color": new, "hits": hits})
+    saved = np.array(saved_colors)
+    hits = (np.abs(new_colors[:, None, 0] - saved[None, :, 0]) > 10).sum(axis=1)
+    return tuple(new_colors[hits.argmax()].tolist())
 
-    return sorted(colors, key=itemgetter("hits"), reverse=True)[0]
+
+def get_slice_candidates(image, slices=10, count=100, quality=10):
+    """
+    Get the most common colors of every vertical slice of an image with
+    colors grouped by their 5 most significant bits. Return a (slices,
+    count, 3) array of colors sorted by frequency and a (slices, count)
+    array of pixel counts (zero for missing colors).
+
+    :param image: PIL.Image object
+    :param slices: number of slices
+    :param count: maximum number of colors per slice
+    :param quality: sample one pixel of every quality pixels per row
+    """
+    pixels = np.asarray(image.convert("RGB"))
+    slice_width = pixels.shape[1] // slices
+    pixels = pixels[:, : slice_width * slices : max(1, min(quality, slice_width))]
+    columns = pixels.shape[1] // slices
+    pixels = pixels[:, : columns * slices]
+
+    # (height, slices, columns, 3) -> (slices, pixels, 3)
+    pixels = pixels.reshape(pixels.shape[0], slices, columns, 3).swapaxes(0, 1)
+    pixels = (pixels.reshape(slices, -1, 3) >> 3).astype(np.int64)
+
+    bins = (pixels[..., 0] << 10) | (pixels[..., 1] << 5) | pixels[..., 2]
+    bins += np.arange(slices)[:, None] << 15
+    counts = np.bincount(bins.ravel(), minlength=slices << 15).reshape(slices, -1)
+
+    top = np.argsort(-counts, axis=1, kind="stable")[:, :count]
+    colors = np.stack([(top >> 10) & 31, (top >> 5) & 31, top & 31], axis=-1)
+
+    return (colors << 3) + 4, np.take_along_axis(counts, top, axis=1)
 
 
 def get_colors_alt(image):
     """
-    Alternative color extractor. This only works with a modified version of
-    colorthief which takes an PIL.Image object as a parameter instead of
-    a file.
+    Alternative color extractor: the most common color of the first slice
+    of the image, followed by the most different color of every other
+    slice.
 
     :param image: PIL.Image object
     """
     logger.debug("Extracting colors")
 
-    width, height = image.size
-    slices = int(width / 10)
-    saved_colors = []
-
-    for i in range(10):
-        box = (i * slices, 0, slices + (i * slices), height)
-        cropped = image.crop(box)
-        thief = ColorThief(
-            cropped,
-        )
-        if i == 0:
-            principal = thief.get_color()
-            saved_colors.append(principal)
-        else:
-            new_colors = thief.get_palette(color_count=100)
-            new_color = get_most_diff(saved_colors, new_colors)
-            if new_color is not None:
-                saved_colors.append(new_color["color"])
+    candidates, counts = get_slice_candidates(image)
+    saved_colors = [tuple(candidates[0, 0].tolist())]
+
+    for colors, found in zip(candidates[1:], counts[1:]):
+        colors = colors[found > 0]
+        if len(colors):
+            saved_colors.append(get_most_diff(saved_colors, colors))
 
     return saved_colors
 
 
+COLOR_ENGINES = {
+    "wand": get_colors,
+    "alt": get_colors_alt,
+    "numpy": get_colors_numpy,
+}
+
+
+def get_color_func(wand=True, engine=None):
+    """
+    :param wand: use wand quantize method to extract colors
+    :param engine: name from COLOR_ENGINES (overrides wand)
+    :raises KeyError
+    """
+    if engine is None:
+        engine = "wand" if wand else "alt"
+
+    return COLOR_ENGINES[engine]
+
+
 def clean_colors(colors, tolerancy=2):
     """
     Remove "too white" colors from a list so the palette looks better.
@@ -105,16 +193,17 @@ def clean_colors(colors, tolerancy=2):
     return colors
 
 
-def get_palette_legacy(image, wand=True):
+def get_palette_legacy(image, wand=True, engine=None):
     """
     Append a palette (old style) to an image. Return the original image if
     something fails (not enough colors, b/w, etc.)
 
     :param image: PIL.Image object
     :param magick: use wand quantize method to extract colors
+    :param engine: name from COLOR_ENGINES (overrides wand)
     """
     width, height = image.size
-    color_func = get_colors if wand else get_colors_alt
+    color_func = get_color_func(wand, engine)
     colors = color_func(image)
 
     palette = clean_colors(colors, tolerancy=3)
@@ -171,7 +260,7 @@ def get_palette_legacy(image, wand=True):
         return image
 
 
-def get_palette(image, border=0.015, wand=True):
+def get_palette(image, border=0.015, wand=True, engine=None, analysis=None):
     """
     Append a nice palette to an image. Return the original image if something
     fails (not enough colors, b/w, etc.)
@@ -179,10 +268,21 @@ def get_palette(image, border=0.015, wand=True):
     :param image: PIL.Image object
     :param border: border size
     :param magick: use wand quantize method to extract colors
+    :param engine: name from COLOR_ENGINES (overrides wand)
+    :param analysis: FrameAnalysis from kinobot.frame.analyze_frame. Its
+    palette colors (if any) are used instead of extracting them again with
+    the numpy engine
     """
     try:
-        color_func = get_colors if wand else get_colors_alt
-        colors = color_func(image)
+        color_func = get_color_func(wand, engine)
+        if (
+            color_func is get_colors_numpy
+            and analysis is not None
+            and analysis.palette_colors is not None
+        ):
+            colors = list(analysis.palette_colors)
+        else:
+            colors = color_func(image)
     except Exception as error:
         logger.error(error, exc_info=True)
         return image
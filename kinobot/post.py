@@ -34,7 +34,16 @@ from kinobot.db import (
 from kinobot.comments import dissect_comment
 from kinobot.frame import draw_quote
 from kinobot.palette import get_palette_legacy
-from kinobot.request import Request
+from kinobot.request import Request, handle_json, search_episode, search_movie
+from kinobot.staging import (
+    claim_staged_request,
+    clean_staging,
+    get_staged_request,
+    get_staging_dir,
+    is_staged,
+    remove_staged_request,
+    stage_request,
+)
 from kinobot.utils import (
     check_image_list_integrity,
     get_collage,
@@ -62,6 +71,8 @@ WEBSITE = "https://kino.caretas.club"
 FACEBOOK_URL = "https://www.facebook.com/certifiedkino"
 FACEBOOK_URL_TV = "https://www.facebook.com/kinobotv"
 GITHUB_REPO = "https://github.com/vitiko98/kinobot"
+# Requests pre-rendered per filter type by the prerender command
+PRERENDER_COUNT = 3
 
 FB = GraphAPI(FACEBOOK)
 FB_TV = GraphAPI(FACEBOOK_TV)
@@ -74,13 +85,14 @@ def check_directory():
         sys.exit(f"Collection not mounted: {FILM_COLLECTION}")
 
 
-def save_images(pil_list, movie_dict, comment_dict):
+def save_images(pil_list, movie_dict, comment_dict, directory=None):
     """
     :param pil_list: list PIL.Image objects
     :param movie_dict: movie dictionary
     :param movie_dict: comment_dict dictionary
+    :param directory: output directory (a new one in FRAMES_DIR if None)
     """
-    directory = os.path.join(FRAMES_DIR, str(time.time()))
+    directory = directory or os.path.join(FRAMES_DIR, str(time.time()))
     os.makedirs(directory, exist_ok=True)
 
     text = (
@@ -335,38 +347,78 @@ def get_reacts_count(post_id):
     return reacts_len
 
 
-def generate_frames(comment_dict, is_multiple=True):
+def finish_dispatched(requests, record=True):
+    """
+    Finish (and register) already dispatched requests after a failure, so
+    they are recorded just like frames rendered one by one were. Errors are
+    only logged, as the original failure is the one reported.
+
+    :param requests: list of request.Request objects
+    :param record: register the frames in REQUESTS_JSON
     """
+    for request in requests:
+        try:
+            request.finish(record)
+        except Exception as error:
+            logger.error(error)
+
+
+def dispatch_frames(comment_dict, is_multiple=True, record=True):
+    """
+    Start rendering the frames of a request. Return a list of
+    request.Request objects to finish in order.
+
     :param comment_dict: comment dictionary
     :param is_multiple
+    :param record: register the frames in REQUESTS_JSON (if a later frame
+    fails)
     """
     movies = get_list_of_movie_dicts()
     episodes = get_list_of_episode_dicts()
 
-    for frame in comment_dict["content"]:
-        request = Request(
-            frame,
-            movies,
-            episodes,
-            comment_dict,
-            is_multiple,
-        )
-        if request.is_minute:
-            request.handle_minute_request()
-        else:
-            try:
-                request.handle_quote_request()
-            except exceptions.ChainRequest:
-                request.handle_chain_request()
-                yield request
-                break
+    requests = []
+    try:
+        for frame in comment_dict["content"]:
+            request = Request(
+                frame,
+                movies,
+                episodes,
+                comment_dict,
+                is_multiple,
+            )
+            if request.is_minute:
+                request.handle_minute_request()
+            else:
+                try:
+                    request.handle_quote_request()
+                except exceptions.ChainRequest:
+                    request.handle_chain_request()
+                    requests.append(request)
+                    break
+            requests.append(request)
+    except Exception:
+        finish_dispatched(requests, record)
+        raise
+
+    return requests
+
+
+def generate_frames(comment_dict, is_multiple=True, record=True):
+    """
+    :param comment_dict: comment dictionary
+    :param is_multiple
+    :param record: register the frames in REQUESTS_JSON
+    """
+    for request in dispatch_frames(comment_dict, is_multiple, record):
+        request.finish(record)
         yield request
 
 
-def handle_commands(comment_dict, is_multiple=True):
+def handle_commands(comment_dict, is_multiple=True, record=True):
     """
     :param comment_dict: request dictionary
     :param is_multiple
+    :param record: register the frames in REQUESTS_JSON
     """
     requests = []
     if comment_dict["parallel"]:
@@ -385,10 +437,24 @@ def handle_commands(comment_dict, is_multiple=True):
     else:
         requests = [comment_dict]
 
+    # Frames of every movie are rendered at the same time
+    dispatched = []
     for request in requests:
-        yield list(
-            generate_frames(request, is_multiple if len(requests) == 1 else True)
-        )
+        try:
+            dispatched.append(
+                dispatch_frames(
+                    request, is_multiple if len(requests) == 1 else True, record
+                )
+            )
+        except Exception:
+            for request_list in dispatched:
+                finish_dispatched(request_list, record)
+            raise
+
+    for request_list in dispatched:
+        for request in request_list:
+            request.finish(record)
+        yield request_list
 
 
 def get_alt_title(frame_objects, is_episode=False):
@@ -413,13 +479,19 @@ def get_alt_title(frame_objects, is_episode=False):
     return f"{' | '.join(titles)}\nCategory: Kinema Parallels"
 
 
-def get_images(comment_dict, is_multiple, published=False):
+def render_images(comment_dict, is_multiple, record=True, directory=None):
     """
+    Render and save the images of a request. Return the image paths, the
+    lists of request.Request objects from handle_commands and the title of
+    parallel requests.
+
     :param comment_dict: request dictionary
     :param is_multiple: ignore palette generator
-    :param published: published
+    :param record: register the frames in REQUESTS_JSON
+    :param directory: output directory (see save_images)
     """
-    frames = list(handle_commands(comment_dict, is_multiple))
+    request_lists = list(handle_commands(comment_dict, is_multiple, record))
+    frames = request_lists
     alt_title = None
 
     if comment_dict["parallel"]:
@@ -450,7 +522,21 @@ def get_images(comment_dict, is_multiple, published=False):
         if 1 < len(single_image_list) < 4:
             single_image_list = [get_collage(single_image_list, False)]
 
-    saved_images = save_images(single_image_list, frames[0].movie, comment_dict)
+    saved_images = save_images(
+        single_image_list, frames[0].movie, comment_dict, directory
+    )
+
+    return saved_images, request_lists, alt_title
+
+
+def get_images(comment_dict, is_multiple, published=False):
+    """
+    :param comment_dict: request dictionary
+    :param is_multiple: ignore palette generator
+    :param published: published
+    """
+    saved_images, request_lists, alt_title = render_images(comment_dict, is_multiple)
+    frames = request_lists[0]
 
     if not comment_dict["verified"] and published:
         try:
@@ -464,13 +550,51 @@ def get_images(comment_dict, is_multiple, published=False):
     return saved_images, frames, alt_title
 
 
-def handle_request_item(request_dict, published):
+def publish_staged_images(request_dict, meta, published=False):
     """
-    :param request_list: request dictionaries
-    :param published: directly publish to Facebook
+    Publish-time part of get_images for a staged request (see
+    prerender_request_item): register the frames and report the NSFW check.
+    Return the image paths, the movie dictionary and the title of parallel
+    requests.
+
+    :param request_dict: request dictionary
+    :param meta: meta dictionary from staging.get_staged_request
+    :param published: published
+    :raises exceptions.RestingMovie
+    """
+    logger.info(f"Publishing staged request: {request_dict['id']}")
+    movie = meta["movie"]
+
+    # Request.__init__ checks this for rendered requests. Several requests
+    # of the same movie can be staged before any of them is published, so
+    # the staged result is kept for a later run.
+    if request_dict["parallel"] is None:
+        if request_dict["is_episode"]:
+            search_episode(get_list_of_episode_dicts(), request_dict["movie"])
+        else:
+            search_movie(get_list_of_movie_dicts(), request_dict["movie"])
+
+    saved_images = claim_staged_request(request_dict["id"], meta)
+
+    for discriminator in meta["discriminators"]:
+        handle_json(discriminator, request_dict["verified"])
+
+    if not request_dict["verified"] and published and meta["nsfw"]:
+        notify_discord(movie, saved_images, request_dict, True)
+        raise exceptions.NSFWContent
+
+    notify_discord(movie, saved_images, request_dict)
+
+    return saved_images, movie, meta["alt_title"]
+
+
+def prepare_request_item(request_dict):
+    """
+    :param request_dict: request dictionary
+    :raises exceptions.BlockedUser
+    :raises exceptions.TooLongRequest
     """
     block_user(request_dict["user"], check=True)
-    request_command = request_dict["type"]
     request_dict["is_episode"] = is_episode(request_dict["comment"])
     request_dict["parallel"] = is_parallel(request_dict["comment"])
 
@@ -478,18 +602,76 @@ def handle_request_item(request_dict, published):
         raise exceptions.TooLongRequest
 
     logger.info(
-        f"Request command: {request_command} {request_dict['comment']} "
+        f"Request command: {request_dict['type']} {request_dict['comment']} "
         f"(Episode: {request_dict['is_episode']})"
     )
 
-    is_multiple = len(request_dict["content"]) > 1
-    final_imgs, frames, alt_title = get_images(request_dict, is_multiple, published)
+
+def prerender_request_item(request_dict):
+    """
+    Render and NSFW-check a request ahead of time, without registering it
+    in REQUESTS_JSON. The result is published by handle_request_item while
+    the video files and PIPELINE_VERSION don't change.
+
+    :param request_dict: request dictionary
+    """
+    if get_staged_request(request_dict) is not None:
+        logger.info(f"Request already staged: {request_dict['id']}")
+        return
+
+    prepare_request_item(request_dict)
+
+    directory = get_staging_dir(request_dict["id"])
+    os.makedirs(directory, exist_ok=True)
+    try:
+        is_multiple = len(request_dict["content"]) > 1
+        saved_images, request_lists, alt_title = render_images(
+            request_dict, is_multiple, False, directory
+        )
+
+        nsfw = False
+        if not request_dict["verified"]:
+            try:
+                check_nsfw(saved_images)
+            except exceptions.NSFWContent:
+                nsfw = True
+
+        stage_request(
+            request_dict,
+            saved_images,
+            request_lists[0][0].movie,
+            alt_title,
+            [request for request_list in request_lists for request in request_list],
+            nsfw,
+        )
+    except:  # noqa
+        remove_staged_request(request_dict["id"])
+        raise
+
+
+def handle_request_item(request_dict, published):
+    """
+    :param request_list: request dictionaries
+    :param published: directly publish to Facebook
+    """
+    prepare_request_item(request_dict)
+
+    meta = get_staged_request(request_dict)
+    if meta is None:
+        is_multiple = len(request_dict["content"]) > 1
+        final_imgs, frames, alt_title = get_images(request_dict, is_multiple, published)
+        movie = frames[0].movie
+    else:
+        final_imgs, movie, alt_title = publish_staged_images(
+            request_dict, meta, published
+        )
+
     request_dict["parallel"] = alt_title
 
     try:
         post_id = post_request(
             final_imgs,
-            frames[0].movie,
+            movie,
             request_dict,
             published,
             request_dict["is_episode"],
@@ -507,9 +689,9 @@ def handle_request_item(request_dict, published):
         logger.error(error, exc_info=True)
     finally:
         if request_dict["is_episode"]:
-            insert_episode_request_info_to_db(frames[0].movie, request_dict["user"])
+            insert_episode_request_info_to_db(movie, request_dict["user"])
         else:
-            insert_request_info_to_db(frames[0].movie, request_dict["user"])
+            insert_request_info_to_db(movie, request_dict["user"])
 
         update_request_to_used(request_dict["id"])
 
@@ -550,8 +732,55 @@ def handle_request_list(request_list, published=True):
             break
 
 
+def prerender(filter_type="movies", count=PRERENDER_COUNT):
+    """
+    Pre-render the next candidates of a filter type (see
+    prerender_request_item). Priority requests are pre-rendered first.
+
+    :param filter_type: movies or episodes
+    :param count: number of requests to stage
+    """
+    check_directory()
+
+    request_list = get_requests(filter_type, True) + get_requests(filter_type)
+    logger.info(f"Pre-rendering {count} {filter_type} requests")
+
+    seen, staged = set(), set()
+    for request_dict in request_list:
+        if len(staged) >= count:
+            break
+
+        if request_dict["id"] in seen:  # also in the priority list
+            continue
+
+        seen.add(request_dict["id"])
+
+        try:
+            prerender_request_item(request_dict)
+        except (exceptions.RestingMovie, exceptions.DuplicateRequest) as error:
+            logger.info(f"Skipping {request_dict['id']}: {type(error).__name__}")
+            continue
+        except Exception as error:
+            # The request is handled (and notified) at publish time
+            logger.error(error, exc_info=True)
+            continue
+
+        staged.add(request_dict["id"])
+
+    logger.info(f"Staged requests: {len(staged)}")
+
+
+def prefer_staged(request_list):
+    """
+    Move staged requests to the top of a request list.
+
+    :param request_list: list of request dictionaries
+    """
+    return sorted(request_list, key=lambda request: not is_staged(request["id"]))
+
+
 def post(filter_type="movies", test=False):
-    " Find a valid request and post it to Facebook. "
+    "Find a valid request and post it to Facebook."
 
     if test and not REQUESTS_DB.endswith(".save"):
         sys.exit("Kinobot can't run test mode at this time")
@@ -567,6 +796,11 @@ def post(filter_type="movies", test=False):
 
     request_list = get_requests(filter_type)
 
+    if priority_list:
+        priority_list = prefer_staged(priority_list)
+
+    request_list = prefer_staged(request_list)
+
     logger.info(f"Requests found in normal list: {len(request_list)}")
 
     if priority_list:
@@ -582,17 +816,27 @@ def post(filter_type="movies", test=False):
 
 @click.command("post")
 def publish():
-    " Find a valid request and post it to Facebook. "
+    "Find a valid request and post it to Facebook."
     kino_log(KINOLOG)
     post("episodes")
     post()
 
 
+@click.command("prerender")
+@click.option("--count", default=PRERENDER_COUNT, help="requests per filter type")
+def prerender_requests(count):
+    "Render the next requests ahead of time."
+    kino_log(KINOLOG + ".prerender")
+    clean_staging(request["id"] for request in get_requests("all"))
+    prerender("episodes", count)
+    prerender(count=count)
+
+
 # Use a separate command instead of parameters in order to set different
 # databases at runtime with sys.argv[1].
 @click.command("test")
 def testing():
-    " Find a valid request for tests. "
+    "Find a valid request for tests."
     kino_log(KINOLOG + ".test")
     post(test=True)
     post("episodes", test=True)
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# License: GPL
+# Author : Vitiko
+
+import json
+import logging
+import os
+import sqlite3
+import subprocess
+from functools import lru_cache
+
+from kinobot import KINOBASE
+
+logger = logging.getLogger(__name__)
+
+
+def get_file_identity(path):
+    """
+    Return a (path, size, mtime) tuple. Cached data keyed by this tuple is
+    invalidated when the file is replaced.
+
+    :param path: file path
+    :raises OSError
+    """
+    stat = os.stat(path)
+    return path, stat.st_size, int(stat.st_mtime)
+
+
+def run_ffprobe(path):
+    """
+    :param path: video path
+    :raises subprocess.TimeoutExpired
+    """
+    command = [
+        "ffprobe",
+        "-v",
+        "quiet",
+        "-print_format",
+        "json",
+        "-show_format",
+        "-show_streams",
+        path,
+    ]
+    result = subprocess.run(command, stdout=subprocess.PIPE, timeout=60)
+    return json.loads(result.stdout)
+
+
+def get_ratio(value, separator=":"):
+    """
+    Convert an ffprobe ratio string ("16:9", "24000/1001") to a float.
+    Return None for missing or invalid ratios.
+
+    :param value: ratio string
+    :param separator: separator
+    """
+    try:
+        num, den = value.split(separator)
+        return float(num) / float(den) or None
+    except (AttributeError, ValueError, ZeroDivisionError):
+        return None
+
+
+def parse_ffprobe(data):
+    """
+    Extract the useful information from ffprobe's JSON.
+
+    :param data: dictionary from run_ffprobe
+    :raises ValueError
+    """
+    streams = data.get("streams", [])
+    try:
+        video = next(stream for stream in streams if stream["codec_type"] == "video")
+    except StopIteration:
+        raise ValueError("No video stream found") from None
+
+    width, height = video["width"], video["height"]
+    sample_aspect_ratio = get_ratio(video.get("sample_aspect_ratio")) or 1.0
+    display_aspect_ratio = get_ratio(video.get("display_aspect_ratio")) or (
+        (width * sample_aspect_ratio) / height
+    )
+
+    return {
+        "dar": display_aspect_ratio,
+        "sar": sample_aspect_ratio,
+        "fps": get_ratio(video.get("avg_frame_rate"), "/")
+        or get_ratio(video.get("r_frame_rate"), "/"),
+        "duration": float(data.get("format", {}).get("duration", 0)),
+        "width": width,
+        "height": height,
+        "codec": video.get("codec_name"),
+        "subtitles": [
+            {
+                "index": stream["index"],
+                "codec": stream.get("codec_name"),
+                "language": stream.get("tags", {}).get("language"),
+            }
+            for stream in streams
+            if stream["codec_type"] == "subtitle"
+        ],
+    }
+
+
+def get_stored_probe(identity):
+    """
+    :param identity: tuple from get_file_identity
+    """
+    with sqlite3.connect(KINOBASE) as conn:
+        try:
+            row = conn.execute(
+                "select data from PROBES where path=? and size=? and mtime=?",
+                identity,
+            ).fetchone()
+        except sqlite3.OperationalError:
+            logger.info("PROBES table not available")
+            return
+
+    if row is not None:
+        return json.loads(row[0])
+
+
+def store_probe(identity, info):
+    """
+    :param identity: tuple from get_file_identity
+    :param info: dictionary from parse_ffprobe
+    """
+    with sqlite3.connect(KINOBASE) as conn:
+        try:
+            conn.execute(
+                "insert or replace into PROBES (path, size, mtime, data) "
+                "values (?,?,?,?)",
+                (*identity, json.dumps(info)),
+            )
+            conn.commit()
+        except sqlite3.OperationalError as error:
+            logger.error(error)
+
+
+@lru_cache(maxsize=64)
+def _probe(identity):
+    info = get_stored_probe(identity)
+    if info is None:
+        logger.info(f"Probing file: {identity[0]}")
+        info = parse_ffprobe(run_ffprobe(identity[0]))
+        store_probe(identity, info)
+
+    return info
+
+
+def probe(path):
+    """
+    Get the DAR, SAR, FPS, duration (seconds), dimensions, codec and subtitle
+    streams of a video. ffprobe runs only once per file; the result is
+    stored in the PROBES table and reused until the file changes.
+
+    :param path: video path
+    :raises OSError
+    :raises ValueError
+    :raises subprocess.TimeoutExpired
+    """
+    return _probe(get_file_identity(path))
@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# License: GPL
+# Author : Vitiko
+
+import logging
+import re
+import sqlite3
+from collections import namedtuple
+
+from kinobot.probe import get_file_identity
+from kinobot.subtitles import get_subtitles, to_milliseconds
+
+from kinobot import KINOBASE
+
+# Rows of a subtitle are stored in the rowid range [id * STRIDE, (id + 1) *
+# STRIDE), so a subtitle can be replaced without scanning the FTS table
+ROWID_STRIDE = 1000000
+SEARCH_LIMIT = 10
+
+QuoteMatch = namedtuple(
+    "QuoteMatch", ["item_type", "item_id", "index", "start", "end", "quote"]
+)
+
+logger = logging.getLogger(__name__)
+
+
+def get_match_queries(text):
+    """
+    Return FTS5 queries for a phrase: the exact phrase first and then every
+    word in any order.
+
+    :param text: phrase
+    """
+    words = re.findall(r"\w+", text.lower())
+    if not words:
+        return []
+
+    queries = ['"' + " ".join(words) + '"']
+    if len(words) > 1:
+        queries.append(" ".join(f'"{word}"' for word in words))
+
+    return queries
+
+
+def _delete_rows(conn, source_id):
+    conn.execute(
+        "delete from QUOTES where rowid >= ? and rowid < ?",
+        (source_id * ROWID_STRIDE, (source_id + 1) * ROWID_STRIDE),
+    )
+
+
+def index_subtitle(conn, item_type, item_id, path):
+    """
+    Index (or re-index) the lines of a subtitle if the file changed since
+    the last run. Return True if the subtitle was indexed.
+
+    :param conn: sqlite3.Connection object (KINOBASE)
+    :param item_type: movies or episodes
+    :param item_id: TMDB ID (movies) or episode ID
+    :param path: subtitle path
+    :raises OSError
+    :raises srt.SRTParseError
+    """
+    _, size, mtime = get_file_identity(path)
+    row = conn.execute(
+        "select id, item_type, item_id, size, mtime from QUOTE_SOURCES "
+        "where subtitle=?",
+        (path,),
+    ).fetchone()
+
+    if row is not None and row[1:] == (item_type, str(item_id), size, mtime):
+        return False
+
+    subtitles = get_subtitles(path)
+    if len(subtitles) >= ROWID_STRIDE:
+        raise ValueError(f"Too many lines in subtitle: {path}")
+
+    if row is None:
+        source_id = conn.execute(
+            "insert into QUOTE_SOURCES (subtitle, item_type, item_id, size, "
+            "mtime) values (?,?,?,?,?)",
+            (path, item_type, str(item_id), size, mtime),
+        ).lastrowid
+    else:
+        source_id = row[0]
+        _delete_rows(conn, source_id)
+        conn.execute(
+            "update QUOTE_SOURCES set item_type=?, item_id=?, size=?, mtime=? "
+            "where id=?",
+            (item_type, str(item_id), size, mtime, source_id),
+        )
+
+    base = source_id * ROWID_STRIDE
+    conn.executemany(
+        "insert into QUOTES (rowid, quote, source, idx, start_ms, end_ms) "
+        "values (?,?,?,?,?,?)",
+        (
+            (
+                base + position,
+                subtitle.clean,
+                source_id,
+                subtitle.index,
+                to_milliseconds(subtitle.start),
+                to_milliseconds(subtitle.end),
+            )
+            for position, subtitle in enumerate(subtitles)
+        ),
+    )
+    conn.commit()
+    return True
+
+
+def update_quote_index(item_list, item_type="movies"):
+    """
+    Update the QUOTES index of a list of movie/episode dictionaries. Only
+    new or modified subtitles are indexed; subtitles of items not in the
+    list are removed.
+
+    :param item_list: list of movie/episode dictionaries
+    :param item_type: movies or episodes
+    """
+    id_key = "tmdb" if item_type == "movies" else "id"
+    indexed = 0
+
+    with sqlite3.connect(KINOBASE) as conn:
+        for item in item_list:
+            if not item.get("subtitle"):
+                continue
+            try:
+                if index_subtitle(conn, item_type, item[id_key], item["subtitle"]):
+                    indexed += 1
+            except FileNotFoundError:
+                continue
+            except Exception as error:
+                logger.error(error, exc_info=True)
+
+        subtitles = {item["subtitle"] for item in item_list}
+        stale = [
+            source_id
+            for source_id, subtitle in conn.execute(
+                "select id, subtitle from QUOTE_SOURCES where item_type=?",
+                (item_type,),
+            ).fetchall()
+            if subtitle not in subtitles
+        ]
+        for source_id in stale:
+            _delete_rows(conn, source_id)
+            conn.execute("delete from QUOTE_SOURCES where id=?", (source_id,))
+        conn.commit()
+
+    logger.info(
+        f"Quote index updated ({item_type}): {indexed} indexed, {len(stale)} removed"
+    )
+
+
+def search_quotes(text, limit=SEARCH_LIMIT):
+    """
+    Search a phrase in the subtitles of the whole collection. Return a list
+    of QuoteMatch tuples (start and end in milliseconds), best first.
+
+    :param text: phrase
+    :param limit: maximum number of matches
+    """
+    with sqlite3.connect(KINOBASE) as conn:
+        for query in get_match_queries(text):
+            try:
+                rows = conn.execute(
+                    "select s.item_type, s.item_id, q.idx, q.start_ms, q.end_ms, "
+                    "q.quote from QUOTES q join QUOTE_SOURCES s on s.id = q.source "
+                    "where q.quote match ? order by rank limit ?",
+                    (query, limit),
+                ).fetchall()
+            except sqlite3.OperationalError as error:
+                logger.error(error)
+                return []
+
+            if rows:
+                return [QuoteMatch(*row) for row in rows]
+
+    return []
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# License: GPL
+# Author : Vitiko
+
+import logging
+import textwrap
+from collections import namedtuple
+from functools import lru_cache
+
+from PIL import Image, ImageDraw, ImageFont
+
+FONT_CACHE_SIZE = 32
+LAYOUT_CACHE_SIZE = 1024
+
+TextLayout = namedtuple("TextLayout", ["text", "size"])
+
+# Text measurements don't depend on the image being drawn
+_MEASURE_DRAW = ImageDraw.Draw(Image.new("RGB", (1, 1)))
+
+logger = logging.getLogger(__name__)
+
+
+@lru_cache(maxsize=FONT_CACHE_SIZE)
+def get_font(path, size):
+    """
+    Load a TrueType font only once per (path, size).
+
+    :param path: font path
+    :param size: font size
+    :raises OSError
+    """
+    logger.info(f"Loading font: {path} ({size})")
+    return ImageFont.truetype(path, size)
+
+
+def wrap_text(text, width=None):
+    """
+    Adjust line breaks to correctly draw a text: single long lines and texts
+    with more than two lines are wrapped to width characters.
+
+    :param text: text
+    :param width: maximum characters per line (None to keep the lines)
+    """
+    lines = [" ".join(line.split()) for line in text.split("\n")]
+
+    if width is None:
+        return "\n".join(lines)
+
+    if len(lines) == 1 and len(text) > width:
+        return textwrap.fill(text, width=width)
+
+    if len(lines) > 2:
+        return textwrap.fill(" ".join(lines), width=width)
+
+    return "\n".join(lines)
+
+
+@lru_cache(maxsize=LAYOUT_CACHE_SIZE)
+def get_text_layout(text, path, size, width=None):
+    """
+    Get the TextLayout (wrapped text and (width, height) box size) of a text
+    drawn with a font.
+
+    :param text: text
+    :param path: font path
+    :param size: font size
+    :param width: maximum characters per line (see wrap_text)
+    :raises OSError
+    """
+    wrapped = wrap_text(text, width)
+    box_size = _MEASURE_DRAW.textsize(wrapped, get_font(path, size))
+
+    return TextLayout(wrapped, box_size)
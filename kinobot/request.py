@@ -8,19 +8,20 @@ import logging
 import re
 import textwrap
 import time
+from functools import partial
 
 import numpy as np
 from fuzzywuzzy import fuzz, process
+from fuzzywuzzy.utils import full_process
 
 import kinobot.exceptions as exceptions
-from kinobot.frame import get_final_frame
+from kinobot.frame import parse_crop_box, submit_final_frame, submit_final_frames
+from kinobot.subtitles import get_subtitles, has_dialogue
 from kinobot.utils import (
     convert_request_content,
     clean_sub,
-    get_subtitle,
     normalize_request_str,
     check_chain_integrity,
-    check_perfect_chain,
     is_valid_timestamp_request,
 )
 from kinobot import REQUESTS_JSON
@@ -89,9 +90,16 @@ def search_episode(episode_list, query, raise_resting=True):
 def find_quote(subtitle_list, quote):
     """
     Strictly search for a quote in a list of subtitles and return a
-    dictionary.
-
-    :param subtitle_list: subtitle generator from srt
+    dictionary. Exact matches (see normalize_request_str) are returned
+    first. Otherwise, the best WRatio match (the first one on ties) of the
+    lines sharing the most trigrams with the quote (see
+    SubtitleStore.get_candidates) is returned if it scores at least 87 and
+    its normalized length differs from the quote's by one character at
+    most. If it doesn't, the same rule is applied to the best match of the
+    whole subtitle, which is only searched if a line within one character
+    of the quote's length scores at least 87 (no other line can pass).
+
+    :param subtitle_list: subtitles.SubtitleStore object
     :param quote: quote
     :raises exceptions.QuoteNotFound
     :raises exceptions.InvalidRequest
@@ -101,32 +109,82 @@ def find_quote(subtitle_list, quote):
 
     logger.info(f"Looking for the quote: {quote}")
 
-    for sub in subtitle_list:
-        if normalize_request_str(quote, False) == normalize_request_str(
-            sub.content, False
-        ):
-            logger.info("Found perfect match")
-            return to_dict(sub)
+    positions = subtitle_list.get_positions(normalize_request_str(quote, False))
+    if positions:
+        logger.info("Found perfect match")
+        return to_dict(subtitle_list[positions[0]])
 
-    contents = [sub.content for sub in subtitle_list]
-    # Extracting 5 for debugging reasons
-    final_strings = process.extract(quote, contents, limit=5)
-    # logger.info(final_strings)
+    # Same scores as process.extract(quote, contents) with the subtitle
+    # strings processed at compile time. Only the lines sharing the most
+    # trigrams with the quote are scored first.
+    processed_quote = full_process(quote, force_ascii=True)
     cleaned_request = normalize_request_str(quote)
-    cleaned_quote = normalize_request_str(final_strings[0][0])
-    difference = abs(len(cleaned_request) - len(cleaned_quote))
-    log_scores = f"(score: {final_strings[0][1]}; difference: {difference})"
+    score, difference, position = score_quote(
+        subtitle_list,
+        processed_quote,
+        cleaned_request,
+        subtitle_list.get_candidates(processed_quote),
+    )
+    if score < 87 or difference >= 2:
+        # Only lines of (about) the same length can be accepted. If none of
+        # them scores 87, the best line of the subtitle is rejected too;
+        # otherwise every line is scored, as a longer or shorter line could
+        # still score better.
+        logger.info("No good candidates found. Scoring lines of the same length")
+        score, difference, position = score_quote(
+            subtitle_list,
+            processed_quote,
+            cleaned_request,
+            subtitle_list.get_length_positions(len(cleaned_request)),
+        )
+        if score >= 87:
+            logger.info("Scoring every line")
+            score, difference, position = score_quote(
+                subtitle_list,
+                processed_quote,
+                cleaned_request,
+                range(len(subtitle_list)),
+            )
 
-    if final_strings[0][1] < 87 or difference >= 2:
+    log_scores = f"(score: {score}; difference: {difference})"
+
+    if score < 87 or difference >= 2:
         raise exceptions.QuoteNotFound(f"{quote} {log_scores}")
 
     logger.info("Good quote " + log_scores)
 
-    for sub in subtitle_list:
-        if final_strings[0][0] == sub.content:
-            return to_dict(sub)
+    return to_dict(subtitle_list[position])
 
-    raise exceptions.QuoteNotFound(quote)
+
+def score_quote(subtitle_list, processed_quote, cleaned_request, positions):
+    """
+    Find the best fuzzy match of a quote among some lines of a subtitle.
+    Return a (score, difference, position) tuple, where difference is the
+    length difference of the normalized texts (see find_quote); (0, None,
+    None) if there are no lines.
+
+    :param subtitle_list: subtitles.SubtitleStore object
+    :param processed_quote: quote processed like the fuzzy field
+    :param cleaned_request: normalize_request_str(quote)
+    :param positions: positions of the lines to score (in order)
+    """
+    fuzzy_texts = subtitle_list.get_texts("fuzzy")
+    choices = {position: fuzzy_texts[position] for position in positions}
+    # Extracting 5 for debugging reasons
+    final_strings = process.extract(
+        processed_quote,
+        choices,
+        processor=None,
+        scorer=partial(fuzz.WRatio, full_process=False),
+        limit=5,
+    )
+    if not final_strings:
+        return 0, None, None
+
+    _, score, position = final_strings[0]
+    cleaned_quote = subtitle_list.get_texts("clean")[position].lower()
+
+    return score, abs(len(cleaned_request) - len(cleaned_quote)), position
 
 
 def to_dict(sub_obj=None, message=None, start=None, start_m=None, end_m=None, end=None):
@@ -145,12 +203,52 @@ def to_dict(sub_obj=None, message=None, start=None, start_m=None, end_m=None, en
         "end_m": sub_obj.end.microseconds if sub_obj else end_m,
         "end": sub_obj.end.seconds if sub_obj else end,
         "index": sub_obj.index if sub_obj else 0,
+        # Precomputed by compiled subtitles (see split_dialogue)
+        "dialogue": getattr(sub_obj, "dialogue", None),
     }
 
 
+def find_perfect_chain(subtitle_list, content):
+    """
+    Look for a list of quotes in consecutive subtitle lines with the
+    normalized text indices of the subtitle. Return a (positions,
+    first_position) tuple: the positions of the longest chain of exact
+    (case insensitive) matches starting with the first quote (empty if
+    shorter than two lines) and the position of the first exact match of
+    the first quote (None if not found).
+
+    :param subtitle_list: subtitles.SubtitleStore object
+    :param content: list of quotes
+    """
+    requests = [normalize_request_str(quote) for quote in content]
+    # Positions matching every following quote, as sets for O(1) checks
+    following = [set(subtitle_list.get_positions(req, True)) for req in requests[1:]]
+
+    positions = []
+    for start in subtitle_list.get_positions(requests[0], True):
+        length = 1
+        while length < len(requests) and start + length in following[length - 1]:
+            length += 1
+
+        if length > len(positions):
+            positions = list(range(start, start + length))
+
+    if len(positions) == len(requests):
+        logger.info(f"Perfect score: {len(positions)}/{len(requests)}")
+
+    first_positions = subtitle_list.get_positions(
+        normalize_request_str(content[0], False)
+    )
+
+    return (
+        positions if len(positions) > 1 else [],
+        first_positions[0] if first_positions else None,
+    )
+
+
 def guess_subtitle_chain(subtitle_list, req_dictionary):
     """
-    :param subtitle_list: list of srt.Subtitle objects
+    :param subtitle_list: subtitles.SubtitleStore object
     :param req_dictionary: request comment dictionary
     """
     content = req_dictionary["content"]
@@ -162,16 +260,18 @@ def guess_subtitle_chain(subtitle_list, req_dictionary):
     ):
         return
 
-    perfect_chain = check_perfect_chain(content, subtitle_list)
+    perfect_chain, first_position = find_perfect_chain(subtitle_list, content)
     if len(perfect_chain) == len(content):
+        perfect_chain = [subtitle_list[position] for position in perfect_chain]
         logger.info("Found perfect chain: %s" % [per.content for per in perfect_chain])
         return [to_dict(chain) for chain in perfect_chain]
 
-    first_quote = find_quote(subtitle_list, content[0])
-    first_index = first_quote["index"]
+    # find_quote also validates the quote length
+    if first_position is None or not 2 < len(content[0]) <= 130:
+        first_position = find_quote(subtitle_list, content[0])["index"] - 1
 
     chain_list = []
-    for i in range(first_index - 1, (first_index + req_dictionary_length) - 1):
+    for i in range(first_position, first_position + req_dictionary_length):
         chain_list.append(to_dict(subtitle_list[i]))
 
     try:
@@ -215,34 +315,27 @@ def guess_timestamps(og_quote, quotes):
     ]
 
 
-def is_normal(quotes):
-    """
-    :param quotes: list of strings
-    """
-    return any(len(quote) < 2 for quote in quotes) or len(quotes) != 2
-
-
 def split_dialogue(subtitle):
     """
     :param subtitle: subtitle dictionary from find_quote or to_dict
     """
     logger.info("Checking if the subtitle contains dialogue")
-    quote = subtitle["message"].replace("\n-", " -")
-    quotes = quote.split(" - ")
-    if is_normal(quotes):
-        quotes = quote.split(" - ")
-        if is_normal(quotes):
-            return subtitle
-    else:
-        if quotes[0].startswith("- "):
-            fixed_quotes = [
-                fixed.replace("- ", "").strip() for fixed in quotes if len(fixed) > 2
-            ]
-            if len(fixed_quotes) == 1:
-                return subtitle
-            logger.info("Dialogue found")
-            return guess_timestamps(subtitle, fixed_quotes)
-    return subtitle
+    dialogue = subtitle.get("dialogue")
+    if dialogue is None:
+        dialogue = has_dialogue(subtitle["message"])
+
+    if not dialogue:
+        return subtitle
+
+    quotes = subtitle["message"].replace("\n-", " -").split(" - ")
+    fixed_quotes = [
+        fixed.replace("- ", "").strip() for fixed in quotes if len(fixed) > 2
+    ]
+    if len(fixed_quotes) == 1:
+        return subtitle
+
+    logger.info("Dialogue found")
+    return guess_timestamps(subtitle, fixed_quotes)
 
 
 def de_quote_sub(text):
@@ -342,13 +435,14 @@ def replace_request(new_words="Hello", second=None, quote=None):
     )
 
 
-def handle_json(discriminator, verified=False):
+def handle_json(discriminator, verified=False, record=True):
     """
     Check if a quote/minute is a duplicate. If no exception is raised, append
     the quote to REQUESTS_JSON.
 
     :param discriminator: quote/minute info to store in REQUESTS_JSON
     :param verified: ignore already NSFW verified frames
+    :param record: append the quote (only check for duplicates if False)
     :raises exceptions.DuplicateRequest
     """
     with open(REQUESTS_JSON, "r") as f:
@@ -358,6 +452,9 @@ def handle_json(discriminator, verified=False):
             if any(j.replace('"', "") in discriminator for j in json_list):
                 raise exceptions.DuplicateRequest(discriminator)
 
+        if not record:
+            return
+
         json_list.append(discriminator)
 
     with open(REQUESTS_JSON, "w") as f:
@@ -383,11 +480,14 @@ class Request:
 
         self.discriminator, self.chain, self.quote = None, None, None
         self.pill = []
+        # Set by the handle_* methods and consumed by finish
+        self.futures, self.json_discriminator = [], None
         self.content = convert_request_content(content)
         self.req_dictionary = req_dictionary
         self.is_minute = self.content != content
         self.multiple = multiple
         self.dar = self.movie.get("dar")
+        self.crop = parse_crop_box(self.movie.get("crop"))
         self.path = self.movie["path"]
         self.verified = req_dictionary["verified"]
         self.legacy_palette = "!palette" == self.req_dictionary["type"]
@@ -400,24 +500,43 @@ class Request:
             return text[::-1]
         return text
 
+    def finish(self, record=True):
+        """
+        Wait for the frames dispatched by the handle_* methods and register
+        the request (see handle_json).
+
+        :param record: register the request in REQUESTS_JSON (only check for
+        duplicates if False)
+        :raises exceptions.DuplicateRequest
+        :raises exceptions.OffensiveWord
+        :raises timeout_decorator.TimeoutError
+        """
+        self.pill = []
+        for future in self.futures:
+            result = future.result()
+            self.pill.extend(result if isinstance(result, list) else [result])
+
+        handle_json(self.json_discriminator, self.verified, record)
+
     def handle_minute_request(self):
         is_valid_timestamp_request(self.req_dictionary, self.movie)
 
-        self.pill = [
-            get_final_frame(
+        self.futures = [
+            submit_final_frame(
                 self.path,
                 self.content,
                 None,
                 self.multiple if not self.legacy_palette else self.legacy_palette,
                 self.dar,
+                crop_box=self.crop,
             )
         ]
         self.discriminator = f"{self.movie['title']}{self.content}"
-        handle_json(self.get_discriminator(self.discriminator), self.verified)
+        self.json_discriminator = self.get_discriminator(self.discriminator)
 
     def handle_quote_request(self):
         # TODO: an elegant function to handle quote loops
-        subtitles = get_subtitle(self.movie)
+        subtitles = get_subtitles(self.movie["subtitle"])
         chain = guess_subtitle_chain(subtitles, self.req_dictionary)
 
         if isinstance(chain, list):
@@ -432,26 +551,17 @@ class Request:
             except IndexError:
                 quotes = [find_quote(subtitles, self.content)]
 
-            multiple_quote = len(quotes) > 1
-            pils = []
+            shorts = []
             for q in quotes:
                 split_quote = split_dialogue(q)
                 if isinstance(split_quote, list):
-                    for short in split_quote:
-                        pils.append(
-                            get_final_frame(self.path, None, short, True, self.dar)
-                        )
+                    shorts.extend(split_quote)
                 else:
-                    pils.append(
-                        get_final_frame(
-                            self.path,
-                            None,
-                            split_quote,
-                            multiple_quote,
-                            self.dar,
-                        )
-                    )
-            self.pill = pils
+                    shorts.append(split_quote)
+            # Palettes are only generated for single frames
+            self.futures = submit_final_frames(
+                self.path, shorts, len(shorts) > 1, self.dar, self.crop
+            )
             self.discriminator = self.movie["title"] + quotes[0]["message"]
         else:
             logger.info("Trying multiple subs")
@@ -468,37 +578,34 @@ class Request:
                 split_quote = split_dialogue(quote)
 
             if isinstance(split_quote, list):
-                pils = []
-                for short in split_quote:
-                    pils.append(get_final_frame(self.path, None, short, True, self.dar))
                 to_dupe = split_quote[0]["message"]
-                self.pill = pils
+                self.futures = submit_final_frames(
+                    self.path, split_quote, True, self.dar, self.crop
+                )
             else:
-                self.pill = [
-                    get_final_frame(
+                self.futures = [
+                    submit_final_frame(
                         self.path,
                         None,
                         split_quote,
                         self.multiple,
                         self.dar,
                         is_parallel_,
+                        self.crop,
                     )
                 ]
                 to_dupe = split_quote["message"]
             self.discriminator = self.movie["title"] + to_dupe
-        handle_json(self.get_discriminator(self.discriminator), self.verified)
+        self.json_discriminator = self.get_discriminator(self.discriminator)
 
     def handle_chain_request(self):
         self.discriminator = self.movie["title"] + self.chain[0]["message"]
-        pils = []
+        shorts = []
         for q in self.chain:
             split_quote = split_dialogue(q)
             if isinstance(split_quote, list):
-                for short in split_quote:
-                    pils.append(get_final_frame(self.path, None, short, True, self.dar))
+                shorts.extend(split_quote)
             else:
-                pils.append(
-                    get_final_frame(self.path, None, split_quote, True, self.dar)
-                )
-        self.pill = pils
-        handle_json(self.discriminator, self.verified)
+                shorts.append(split_quote)
+        self.futures = submit_final_frames(self.path, shorts, True, self.dar, self.crop)
+        self.json_discriminator = self.discriminator
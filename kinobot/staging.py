@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# License: GPL
+# Author : Vitiko
+
+import json
+import logging
+import os
+import shutil
+import time
+
+from kinobot.frame import PIPELINE_VERSION
+from kinobot.probe import get_file_identity
+
+from kinobot import FRAMES_DIR
+
+STAGING_DIR = os.path.join(FRAMES_DIR, "staging")
+META_FILE = "meta.json"
+
+logger = logging.getLogger(__name__)
+
+
+def get_staging_dir(request_id):
+    """
+    :param request_id: request ID
+    """
+    return os.path.join(STAGING_DIR, str(request_id))
+
+
+def get_identities(paths):
+    """
+    :param paths: video paths
+    :raises OSError
+    """
+    return [list(get_file_identity(path)) for path in paths]
+
+
+def stage_request(request_dict, images, movie_dict, alt_title, requests, nsfw):
+    """
+    Store the result of a pre-rendered request. The images must be already
+    saved in the staging directory of the request.
+
+    :param request_dict: request dictionary
+    :param images: list of image paths
+    :param movie_dict: movie dictionary of the first frame
+    :param alt_title: title of parallel requests (or None)
+    :param requests: every request.Request object of the request
+    :param nsfw: the images failed the NSFW check
+    """
+    paths = sorted({request.path for request in requests})
+    meta = {
+        "id": request_dict["id"],
+        "comment": request_dict["comment"],
+        "verified": request_dict["verified"],
+        "movie": movie_dict,
+        "alt_title": alt_title,
+        "discriminators": [request.json_discriminator for request in requests],
+        "identities": get_identities(paths),
+        "pipeline_version": PIPELINE_VERSION,
+        "images": [os.path.basename(image) for image in images],
+        "nsfw": nsfw,
+        "staged": time.time(),
+    }
+
+    directory = get_staging_dir(request_dict["id"])
+    tmp_path = os.path.join(directory, META_FILE + ".tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(meta, f)
+    os.replace(tmp_path, os.path.join(directory, META_FILE))
+
+    logger.info(f"Staged request {request_dict['id']}: {len(images)} image(s)")
+
+
+def get_staged_request(request_dict):
+    """
+    Return the meta dictionary of a staged request or None. Staged results
+    made from another comment, another pipeline version or replaced video
+    files are removed.
+
+    :param request_dict: request dictionary
+    """
+    directory = get_staging_dir(request_dict["id"])
+    try:
+        with open(os.path.join(directory, META_FILE)) as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    try:
+        paths = [identity[0] for identity in meta["identities"]]
+        valid = (
+            meta["comment"] == request_dict["comment"]
+            and meta["verified"] == request_dict["verified"]
+            and meta["pipeline_version"] == PIPELINE_VERSION
+            and get_identities(paths) == meta["identities"]
+            and all(
+                os.path.isfile(os.path.join(directory, image))
+                for image in meta["images"]
+            )
+        )
+    except (KeyError, OSError):
+        valid = False
+
+    if not valid:
+        logger.info(f"Discarding outdated staged request: {request_dict['id']}")
+        remove_staged_request(request_dict["id"])
+        return None
+
+    return meta
+
+
+def claim_staged_request(request_id, meta):
+    """
+    Move the images of a staged request to a regular frames directory (as
+    kinobot.post.save_images does) and return their paths.
+
+    :param request_id: request ID
+    :param meta: meta dictionary from get_staged_request
+    """
+    directory = os.path.join(FRAMES_DIR, str(time.time()))
+    os.replace(get_staging_dir(request_id), directory)
+    os.remove(os.path.join(directory, META_FILE))
+
+    return [os.path.join(directory, image) for image in meta["images"]]
+
+
+def remove_staged_request(request_id):
+    """
+    :param request_id: request ID
+    """
+    shutil.rmtree(get_staging_dir(request_id), ignore_errors=True)
+
+
+def clean_staging(request_ids):
+    """
+    Remove staged requests not found in request_ids (used or deleted
+    requests).
+
+    :param request_ids: IDs of pending requests
+    """
+    if not os.path.isdir(STAGING_DIR):
+        return
+
+    keep = {str(request_id) for request_id in request_ids}
+    for name in os.listdir(STAGING_DIR):
+        if name not in keep:
+            logger.info(f"Removing staged request: {name}")
+            remove_staged_request(name)
+
+
+def is_staged(request_id):
+    """
+    :param request_id: request ID
+    """
+    return os.path.isfile(os.path.join(get_staging_dir(request_id), META_FILE))
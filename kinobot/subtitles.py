@@ -0,0 +1,337 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# License: GPL
+# Author : Vitiko
+
+import hashlib
+import json
+import logging
+import mmap
+import os
+import tempfile
+from collections.abc import Sequence
+from datetime import timedelta
+from functools import lru_cache
+
+import numpy as np
+import srt
+from fuzzywuzzy.utils import full_process
+
+from kinobot.cache import CACHE_DIR
+from kinobot.probe import get_file_identity
+from kinobot.utils import normalize_request_str
+
+COMPILED_DIR = os.path.join(CACHE_DIR, "subtitles")
+# Increase it every time the compiled format changes
+COMPILED_VERSION = 2
+SUBTITLE_CACHE_SIZE = 16
+# Lines scored by the fuzzy matcher (see SubtitleStore.get_candidates)
+FUZZY_CANDIDATES = 64
+
+# Text fields are (offset, size) byte ranges of the UTF-8 text blob
+SUBTITLE_DTYPE = np.dtype(
+    [
+        ("index", "<i4"),
+        ("start", "<i8"),  # milliseconds
+        ("end", "<i8"),
+        ("content", "<i8", 2),
+        ("clean", "<i8", 2),  # normalize_request_str(content, False)
+        ("fuzzy", "<i8", 2),  # what fuzzywuzzy's WRatio compares
+        ("dialogue", "u1"),  # see has_dialogue
+    ]
+)
+
+logger = logging.getLogger(__name__)
+
+
+def has_dialogue(text):
+    """
+    Check if a subtitle line has two dialogue parts ("- Hi. - Hello.").
+    kinobot.request.split_dialogue only splits these lines.
+
+    :param text: subtitle content
+    """
+    quotes = text.replace("\n-", " -").split(" - ")
+    return (
+        len(quotes) == 2
+        and all(len(quote) >= 2 for quote in quotes)
+        and quotes[0].startswith("- ")
+    )
+
+
+def get_trigrams(text):
+    """
+    Return the set of character trigrams of a text (padded with spaces, so
+    short words still have trigrams).
+
+    :param text: text
+    """
+    text = f" {text} "
+    return {text[i : i + 3] for i in range(len(text) - 2)}
+
+
+def to_milliseconds(delta):
+    """
+    :param delta: datetime.timedelta object
+    """
+    return delta // timedelta(milliseconds=1)
+
+
+class CompiledSubtitle(srt.Subtitle):
+    """
+    srt.Subtitle with the precomputed fields of a compiled subtitle file.
+    """
+
+    def __init__(self, index, start, end, content, clean="", dialogue=False):
+        super().__init__(index, start, end, content)
+        self.clean = clean
+        self.dialogue = dialogue
+
+
+class SubtitleStore(Sequence):
+    """
+    Read-only sequence of CompiledSubtitle objects backed by the memory
+    mapped files of a compiled subtitle (see compile_subtitle). Items are
+    only built when accessed.
+
+    :param array: SUBTITLE_DTYPE array
+    :param blob: text blob (bytes-like)
+    """
+
+    def __init__(self, array, blob):
+        self.array = array
+        self.blob = blob
+        self._texts = {}
+        self._clean_indices = {}
+        self._lengths = None
+        self._trigram_index = None
+        self._trigram_sizes = None
+
+    def __len__(self):
+        return len(self.array)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+
+        row = self.array[index]  # negative indices included
+
+        return CompiledSubtitle(
+            int(row["index"]),
+            timedelta(milliseconds=int(row["start"])),
+            timedelta(milliseconds=int(row["end"])),
+            self._get_text(row["content"]),
+            self._get_text(row["clean"]),
+            bool(row["dialogue"]),
+        )
+
+    def get_texts(self, field):
+        """
+        Return the decoded texts of a field (content, clean or fuzzy) of
+        every line. Texts are decoded only once.
+
+        :param field: text field
+        """
+        if field not in self._texts:
+            self._texts[field] = [
+                self._get_text(row) for row in self.array[field].tolist()
+            ]
+
+        return self._texts[field]
+
+    def get_positions(self, clean, lowercase=False):
+        """
+        Return the positions of the lines whose clean text is exactly clean.
+
+        :param clean: text normalized by normalize_request_str(text, False)
+        (or normalize_request_str(text) if lowercase)
+        :param lowercase: compare lowercased texts
+        """
+        if lowercase not in self._clean_indices:
+            index = {}
+            for position, text in enumerate(self.get_texts("clean")):
+                index.setdefault(text.lower() if lowercase else text, []).append(
+                    position
+                )
+            self._clean_indices[lowercase] = index
+
+        return self._clean_indices[lowercase].get(clean, [])
+
+    def get_length_positions(self, length, tolerance=1):
+        """
+        Return the positions (in order) of the lines whose lowercased clean
+        text length differs from length by tolerance characters at most.
+
+        :param length: text length
+        :param tolerance: maximum difference
+        """
+        if self._lengths is None:
+            self._lengths = np.array(
+                [len(text.lower()) for text in self.get_texts("clean")],
+                dtype=np.int64,
+            )
+
+        return np.flatnonzero(np.abs(self._lengths - length) <= tolerance).tolist()
+
+    def get_candidates(self, text, limit=FUZZY_CANDIDATES):
+        """
+        Return the positions (in order) of the lines sharing the most
+        trigrams with a text. Lines without shared trigrams are never
+        returned.
+
+        :param text: text processed like the fuzzy field
+        :param limit: maximum number of positions
+        """
+        if self._trigram_index is None:
+            index, sizes = {}, np.zeros(len(self), dtype=np.int32)
+            for position, line in enumerate(self.get_texts("fuzzy")):
+                trigrams = get_trigrams(line)
+                sizes[position] = len(trigrams)
+                for trigram in trigrams:
+                    index.setdefault(trigram, []).append(position)
+            self._trigram_index = {
+                trigram: np.array(positions, dtype=np.int32)
+                for trigram, positions in index.items()
+            }
+            self._trigram_sizes = sizes
+
+        trigrams = get_trigrams(text)
+        postings = [
+            self._trigram_index[trigram]
+            for trigram in trigrams
+            if trigram in self._trigram_index
+        ]
+        if not postings:
+            return []
+
+        counts = np.bincount(np.concatenate(postings), minlength=len(self))
+        # Lines containing the text (partial ratios) and lines similar to the
+        # whole text (plain ratios). Stable sorts keep the subtitle order of
+        # ties.
+        dice = counts / (self._trigram_sizes + len(trigrams))
+        shortlist = np.union1d(
+            np.argsort(-counts, kind="stable")[:limit],
+            np.argsort(-dice, kind="stable")[:limit],
+        )
+
+        return shortlist[counts[shortlist] > 0].tolist()
+
+    def _get_text(self, field):
+        offset, size = int(field[0]), int(field[1])
+        return bytes(self.blob[offset : offset + size]).decode()
+
+
+def get_compiled_paths(path):
+    """
+    Return the (meta, array, blob) paths of a compiled subtitle.
+
+    :param path: subtitle path
+    """
+    digest = hashlib.sha1(path.encode()).hexdigest()
+    base = os.path.join(COMPILED_DIR, digest[:2], digest)
+    return base + ".json", base + ".npy", base + ".txt"
+
+
+def _write_atomic(path, write_func):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    with os.fdopen(fd, "wb") as tmp_file:
+        write_func(tmp_file)
+    os.replace(tmp_path, path)
+
+
+def compile_subtitle(path):
+    """
+    Parse a subtitle file and store its compiled version. The meta file is
+    written last, so readers never see incomplete compilations.
+
+    :param path: subtitle path
+    :raises OSError
+    :raises srt.SRTParseError
+    """
+    identity = get_file_identity(path)
+
+    with open(path, "r") as f:
+        subtitles = list(srt.parse(f))
+
+    array = np.zeros(len(subtitles), dtype=SUBTITLE_DTYPE)
+    chunks, offset = [], 0
+    for row, subtitle in zip(array, subtitles):
+        for field, text in (
+            ("content", subtitle.content),
+            ("clean", normalize_request_str(subtitle.content, False)),
+            ("fuzzy", full_process(subtitle.content, force_ascii=True)),
+        ):
+            encoded = text.encode()
+            row[field] = offset, len(encoded)
+            chunks.append(encoded)
+            offset += len(encoded)
+
+        row["index"] = subtitle.index
+        row["start"] = to_milliseconds(subtitle.start)
+        row["end"] = to_milliseconds(subtitle.end)
+        row["dialogue"] = has_dialogue(subtitle.content)
+
+    meta_path, array_path, blob_path = get_compiled_paths(path)
+    os.makedirs(os.path.dirname(meta_path), exist_ok=True)
+
+    _write_atomic(array_path, lambda f: np.save(f, array))
+    _write_atomic(blob_path, lambda f: f.write(b"".join(chunks)))
+    meta = {
+        "identity": list(identity),
+        "version": COMPILED_VERSION,
+        "count": len(subtitles),
+    }
+    _write_atomic(meta_path, lambda f: f.write(json.dumps(meta).encode()))
+
+    logger.info(f"Compiled subtitle: {path} ({len(subtitles)} lines)")
+
+
+def is_compiled(path, identity=None):
+    """
+    Check if a subtitle has an up-to-date compiled version.
+
+    :param path: subtitle path
+    :param identity: file identity (see kinobot.probe.get_file_identity)
+    :raises OSError
+    """
+    identity = identity or get_file_identity(path)
+    try:
+        with open(get_compiled_paths(path)[0]) as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return False
+
+    return (
+        meta.get("identity") == list(identity)
+        and meta.get("version") == COMPILED_VERSION
+    )
+
+
+@lru_cache(maxsize=SUBTITLE_CACHE_SIZE)
+def _load_subtitles(identity):
+    path = identity[0]
+    if not is_compiled(path, identity):
+        compile_subtitle(path)
+
+    _, array_path, blob_path = get_compiled_paths(path)
+    array = np.load(array_path, mmap_mode="r")
+
+    with open(blob_path, "rb") as f:
+        if os.fstat(f.fileno()).st_size:
+            blob = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        else:  # mmap can't map empty files
+            blob = b""
+
+    return SubtitleStore(array, blob)
+
+
+def get_subtitles(path):
+    """
+    Return the SubtitleStore of a subtitle file, compiling it first if
+    needed. Compiled files are invalidated when the subtitle is replaced.
+
+    :param path: subtitle path
+    :raises OSError
+    :raises srt.SRTParseError
+    """
+    return _load_subtitles(get_file_identity(path))
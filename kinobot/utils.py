@@ -3,24 +3,23 @@
 # License: GPL
 # Author : Vitiko
 
+import ctypes
 import glob
 import distro
-import io
 import json
 import logging
 import os
 import random
 import re
-import subprocess
 
 import logging.handlers as handlers
 from pathlib import Path
 
 import numpy as np
+import wand.api
 import wand.image
 import requests
-import srt
-from PIL import Image, ImageDraw, ImageFont, ImageOps, ImageStat
+from PIL import Image, ImageDraw, ImageOps, ImageStat
 from plexapi.server import PlexServer
 
 from kinobot import (
@@ -34,6 +33,8 @@ from kinobot import (
     PLEX_URL,
     PLEX_ACCOUNT_ID,
 )
+from kinobot.probe import probe
+from kinobot.rendering import get_font
 from kinobot.exceptions import (
     InconsistentImageSizes,
     InconsistentSubtitleChain,
@@ -70,6 +71,9 @@ FOOTER = "kino.caretas.club"
 MINUTE_RE = re.compile(r"[^[]*\{([^]]*)\}")
 ID_RE = re.compile(r"ID:\ (.*?);")
 USER_RE = re.compile(r"user:\ (.*?);")
+CLEAN_SUB_RE = re.compile(r"<.*?>|🎶|♪")
+# StorageType of raw pixel buffers shared with ImageMagick (unsigned char)
+WAND_CHAR_STORAGE = wand.image.STORAGE_TYPES.index("char")
 
 
 logger = logging.getLogger(__name__)
@@ -225,21 +229,7 @@ def get_video_length(filename):
     :param filename: filename
     :raises subprocess.TimeoutExpired
     """
-    result = subprocess.run(
-        [
-            "ffprobe",
-            "-v",
-            "error",
-            "-show_entries",
-            "format=duration",
-            "-of",
-            "default=noprint_wrappers=1:nokey=1",
-            filename,
-        ],
-        stdout=subprocess.PIPE,
-        timeout=30,
-    )
-    length = int(result.stdout.decode().replace("\n", "").split(".")[0])
+    length = int(probe(filename)["duration"])
     logger.info(f"Found length: {length}")
     return length
 
@@ -264,8 +254,7 @@ def clean_sub(text):
 
     :param text: text
     """
-    cleaner = re.compile(r"<.*?>|🎶|♪")
-    return re.sub(cleaner, "", text).replace(". . .", "...").strip()
+    return CLEAN_SUB_RE.sub("", text).replace(". . .", "...").strip()
 
 
 def convert_request_content(content):
@@ -293,10 +282,14 @@ def is_valid_timestamp_request(request_dict, movie_dict):
     :raises exceptions.InvalidSource
     :raises exceptions.InvalidRequest
     """
-    runtime_movie = convert_request_content(movie_dict["runtime"])
+    try:
+        runtime_movie = get_video_length(movie_dict["path"])
+    except Exception as error:  # Fall back to the stored runtime
+        logger.error(error)
+        runtime_movie = convert_request_content(movie_dict["runtime"])
 
-    if runtime_movie == movie_dict["runtime"]:
-        raise InvalidRequest(runtime_movie)
+        if runtime_movie == movie_dict["runtime"]:
+            raise InvalidRequest(runtime_movie)
 
     runtime_request = convert_request_content(
         extract_total_minute(request_dict["comment"])
@@ -307,56 +300,6 @@ def is_valid_timestamp_request(request_dict, movie_dict):
     logger.info(f"Valid timestamp request: {runtime_movie}/{runtime_request}")
 
 
-def check_sub_matches(subtitle, subtitle_list, request_list):
-    """
-    :param subtitle: first srt.Subtitle object reference
-    :param subtitle_list: list of srt.Subtitle objects
-    :param request_list: list of request dictionaries
-    """
-    inc = 1
-    hits = 1
-    index_list = [subtitle.index - 1]
-    while True:
-        index_ = (subtitle.index + inc) - 1
-        try:
-            subtitle_ = subtitle_list[index_]
-            if request_list[inc] == normalize_request_str(subtitle_.content):
-                hits += 1
-                inc += 1
-                index_list.append(index_)
-            else:
-                break
-        except IndexError:
-            break
-
-    if len(request_list) == len(index_list):
-        logger.info(f"Perfect score: {hits}/{len(request_list)}")
-
-    return index_list
-
-
-def check_perfect_chain(request_list, subtitle_list):
-    """
-    Return a list of srt.Subtitle objects if more than one coincidences
-    are found.
-
-    :param request_list: list of request dictionaries
-    :param subtitle_list: list of srt.Subtitle objects
-    """
-    request_list = [normalize_request_str(req) for req in request_list]
-    hits = 0
-    for subtitle in subtitle_list:
-        if request_list[0] == normalize_request_str(subtitle.content):
-            loop_hits = check_sub_matches(subtitle, subtitle_list, request_list)
-            if len(loop_hits) > hits:
-                hits = len(loop_hits)
-                index_list = loop_hits
-
-    if hits > 1:
-        return [subtitle_list[index] for index in index_list]
-    return []
-
-
 def check_chain_integrity(request_list, chain_list):
     """
     Check if a list of requests strictly matchs a chain of subtitles.
@@ -372,16 +315,6 @@ def check_chain_integrity(request_list, chain_list):
             raise InconsistentSubtitleChain(f"{og_len} - {chain_len}")
 
 
-def get_subtitle(item={}, key="subtitle", path=None):
-    """
-    :param item: movie dictionary
-    :param key: key from movie dictionary
-    :param path: force reading from file path
-    """
-    with open(item.get(key) if not path else path, "r") as it:
-        return list(srt.parse(it))
-
-
 def get_hue_saturation_mean(image):
     """
     :param image: PIL.Image object
@@ -462,11 +395,10 @@ def decorate_info(image, foreground, new_w, new_h):
     :param new_h: new height integer
     """
     height, width = image.size
-    font = ImageFont.truetype(FONT, 37)
-    font_foot = ImageFont.truetype(FONT, 33)
+    font = get_font(FONT, 37)
+    font_foot = get_font(FONT, 33)
 
     draw = ImageDraw.Draw(image)
-    text_h, text_w = draw.textsize(HEADER, font)
     draw.text((int(new_h * 1.75), 39), HEADER, fill=foreground, font=font)
     draw.text((int(new_h * 1.75), width - 98), FOOTER, fill=foreground, font=font_foot)
     return image
@@ -532,24 +464,70 @@ def homogenize_images(images):
     return [crop_image(image, new_width, new_height) for image in thumbnails]
 
 
+def wand_to_array(wand_img):
+    """
+    Export the pixels of a Wand image to an RGB array without encoding.
+
+    :param wand_img: wand.image.Image object
+    """
+    width, height = wand_img.size
+    array = np.empty((height, width, 3), dtype=np.uint8)
+    # The channel map is explicit as Wand's own array interface fails with
+    # b/w images
+    exported = wand.api.library.MagickExportImagePixels(
+        wand_img.wand,
+        0,
+        0,
+        width,
+        height,
+        b"RGB",
+        WAND_CHAR_STORAGE,
+        array.ctypes.data_as(ctypes.c_void_p),
+    )
+    if not exported:
+        wand_img.raise_exception()
+
+    return array
+
+
+def array_to_wand(array):
+    """
+    Import an RGB array to a new Wand image without encoding.
+
+    :param array: uint8 array with (height, width, 3) shape
+    """
+    array = np.ascontiguousarray(array, dtype=np.uint8)
+    height, width = array.shape[:2]
+    # Blank images (Image(width=..., height=...)) are transparent and
+    # importing RGB pixels keeps their alpha, so the image is built from
+    # the pixels instead
+    magick = wand.image.Image()
+    imported = wand.api.library.MagickConstituteImage(
+        magick.wand,
+        width,
+        height,
+        b"RGB",
+        WAND_CHAR_STORAGE,
+        array.ctypes.data_as(ctypes.c_void_p),
+    )
+    if not imported:
+        magick.raise_exception()
+
+    return magick
+
+
 def wand_to_pil(wand_img):
     """
     :param wand_img: wand.image.Image object
     """
-    # Using io.BytesIO; numpy arrays seem to fail with b/w images
-    return Image.open(io.BytesIO(wand_img.make_blob("png"))).convert("RGB")
+    return Image.fromarray(wand_to_array(wand_img))
 
 
 def pil_to_wand(image):
     """
     :param image: PIL.Image object
     """
-    filelike = io.BytesIO()
-    image.save(filelike, "JPEG")
-    filelike.seek(0)
-    magick = wand.image.Image(blob=filelike)
-    filelike.close()
-    return magick
+    return array_to_wand(np.asarray(image.convert("RGB")))
 
 
 def handle_kino_songs(song=None):
@@ -0,0 +1,339 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# License: GPL
+# Author : Vitiko
+
+import atexit
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
+from multiprocessing import resource_tracker, shared_memory
+
+from PIL import Image
+from timeout_decorator import timeout_decorator
+
+import kinobot
+
+# Rendering also waits for subprocesses and disk, so use at least two
+RENDER_WORKERS = max(2, min(8, os.cpu_count() or 1))
+SHUTDOWN_TIMEOUT = 5
+# Imported once by the fork server, so new workers start with them
+PRELOAD_MODULES = ("kinobot.frame",)
+
+logger = logging.getLogger(__name__)
+
+
+def put_image(image):
+    """
+    Copy a PIL.Image to a new shared memory block. Return a (name, mode,
+    size) tuple; the receiver is responsible for unlinking the block.
+
+    :param image: PIL.Image object
+    """
+    data = image.tobytes()
+    block = shared_memory.SharedMemory(create=True, size=max(1, len(data)))
+    try:
+        block.buf[: len(data)] = data
+    finally:
+        block.close()
+
+    return block.name, image.mode, image.size
+
+
+def get_image(name, mode, size):
+    """
+    Load (and unlink) a PIL.Image from a shared memory block made by
+    put_image.
+
+    :param name: block name
+    :param mode: image mode
+    :param size: image size
+    """
+    block = shared_memory.SharedMemory(name=name)
+    try:
+        image = Image.frombytes(mode, size, block.buf)
+    finally:
+        block.close()
+        block.unlink()
+
+    return image
+
+
+def export_result(result):
+    """
+    Replace PIL.Image objects (alone or in lists) with shared memory
+    references.
+
+    :param result: task result
+    """
+    if isinstance(result, Image.Image):
+        return "image", put_image(result)
+
+    if isinstance(result, list) and all(
+        isinstance(item, Image.Image) for item in result
+    ):
+        return "images", [put_image(item) for item in result]
+
+    return "value", result
+
+
+def import_result(kind, payload):
+    """
+    Inverse of export_result.
+
+    :param kind: result kind
+    :param payload: result payload
+    """
+    if kind == "image":
+        return get_image(*payload)
+
+    if kind == "images":
+        return [get_image(*item) for item in payload]
+
+    return payload
+
+
+def copy_future(target, source):
+    """
+    Copy the outcome of a finished Future to another Future.
+
+    :param target: pending concurrent.futures.Future
+    :param source: finished concurrent.futures.Future
+    """
+    if source.cancelled():
+        target.cancel()
+    elif source.exception() is not None:
+        target.set_exception(source.exception())
+    else:
+        target.set_result(source.result())
+
+
+def export_settings():
+    """
+    Copy the kinobot settings to the environment. Modules preloaded by the
+    fork server read them from there, so settings changed at runtime (test
+    mode in run.py) must be exported before the fork server starts.
+    """
+    for name, value in vars(kinobot).items():
+        if name.isupper() and name in os.environ and isinstance(value, str):
+            os.environ[name] = value
+
+
+def worker_loop(conn):
+    """
+    Run (func, args, kwargs) tasks from a pipe until None is received.
+
+    :param conn: multiprocessing.connection.Connection object
+    """
+    # The parent handles interruptions and kills overrunning workers
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    while True:
+        try:
+            task = conn.recv()
+        except EOFError:
+            break
+
+        if task is None:
+            break
+
+        func, args, kwargs = task
+        try:
+            message = ("ok", export_result(func(*args, **kwargs)))
+        except Exception as error:
+            message = ("error", error)
+
+        try:
+            conn.send(message)
+        except Exception as error:  # unpicklable exceptions
+            conn.send(("error", RuntimeError(repr(error))))
+
+
+class RenderWorker:
+    """
+    Long-lived render process. Workers are forked from a fork server (see
+    RenderPool), so they start with the PRELOAD_MODULES imports but without
+    the threads, locks and connections of the bot process.
+
+    :param context: multiprocessing context
+    """
+
+    def __init__(self, context):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(
+            target=worker_loop, args=(child_conn,), daemon=True
+        )
+        self.process.start()
+        child_conn.close()
+        logger.info(f"Render worker started: {self.process.pid}")
+
+    def kill(self):
+        logger.info(f"Killing render worker: {self.process.pid}")
+        self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+    def stop(self):
+        try:
+            self.conn.send(None)
+            self.process.join(SHUTDOWN_TIMEOUT)
+        except (OSError, ValueError):
+            pass
+
+        if self.process.is_alive():
+            self.kill()
+        else:
+            self.conn.close()
+
+
+class RenderPool:
+    """
+    Pool of persistent render worker processes. Every task has a deadline;
+    workers that overrun it are killed and replaced. Images are returned
+    through shared memory instead of being pickled.
+
+    Workers are started from threads (submit), and forking a threaded
+    process copies locks held by other threads (logging, sqlite, the
+    capture pool). So workers are forked by the single-threaded fork server
+    of multiprocessing instead.
+
+    :param size: maximum number of workers (and concurrent tasks)
+    :param preload: modules imported by the fork server
+    """
+
+    def __init__(self, size=RENDER_WORKERS, preload=PRELOAD_MODULES):
+        self.size = size
+        self._context = multiprocessing.get_context("forkserver")
+        self._context.set_forkserver_preload(list(preload))
+        self._workers = []
+        # Last used workers first, so warm ones are reused
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def run(self, func, args=(), kwargs=None, timeout=15):
+        """
+        Run func(*args, **kwargs) in a worker and return its result.
+
+        :param func: picklable (module level) function
+        :param args: positional arguments
+        :param kwargs: keyword arguments
+        :param timeout: seconds before the worker is killed
+        :raises timeout_decorator.TimeoutError
+        :raises OSError: the worker died
+        """
+        worker = self._acquire()
+        try:
+            worker.conn.send((func, args, kwargs or {}))
+            if not worker.conn.poll(timeout):
+                self._replace(worker)
+                raise timeout_decorator.TimeoutError(
+                    f"Render task exceeded {timeout} seconds"
+                )
+            status, result = worker.conn.recv()
+        except (EOFError, OSError) as error:
+            self._replace(worker)
+            raise OSError(f"Render worker died: {error}") from None
+
+        self._idle.put(worker)
+
+        if status == "error":
+            raise result
+
+        return import_result(*result)
+
+    def submit(self, func, args=(), kwargs=None, timeout=15):
+        """
+        Non-blocking version of run. Return a concurrent.futures.Future; at
+        most size tasks run at the same time.
+
+        :param func: picklable (module level) function
+        :param args: positional arguments
+        :param kwargs: keyword arguments
+        :param timeout: seconds before the worker is killed
+        """
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    self.size, thread_name_prefix="render"
+                )
+
+        return self._executor.submit(self.run, func, args, kwargs, timeout)
+
+    def submit_after(self, future, func, args=(), kwargs=None, timeout=15):
+        """
+        Version of submit for tasks that depend on another one: the task is
+        only submitted once future succeeds. Return a
+        concurrent.futures.Future, which fails like future if it fails.
+
+        :param future: concurrent.futures.Future
+        :param func: picklable (module level) function
+        :param args: positional arguments
+        :param kwargs: keyword arguments
+        :param timeout: seconds before the worker is killed
+        """
+        chained = Future()
+
+        def start(done):
+            if done.cancelled() or done.exception() is not None:
+                copy_future(chained, done)
+                return
+            try:
+                task = self.submit(func, args, kwargs, timeout)
+            except RuntimeError as error:  # shut down meanwhile
+                chained.set_exception(error)
+                return
+            task.add_done_callback(partial(copy_future, chained))
+
+        future.add_done_callback(start)
+        return chained
+
+    def shutdown(self):
+        """
+        Stop every worker.
+        """
+        with self._lock:
+            workers, self._workers = self._workers, []
+            self._idle = queue.LifoQueue()
+            executor, self._executor = self._executor, None
+
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+        for worker in workers:
+            worker.stop()
+
+    def _acquire(self):
+        with self._lock:
+            if self._idle.empty() and len(self._workers) < self.size:
+                # Workers and the parent must share the tracker (the fork
+                # server passes it on), as the parent unlinks the blocks
+                # made by workers
+                resource_tracker.ensure_running()
+                export_settings()
+                worker = RenderWorker(self._context)
+                self._workers.append(worker)
+                return worker
+
+        return self._idle.get()
+
+    def _replace(self, worker):
+        worker.kill()
+        with self._lock:
+            if worker not in self._workers:  # shut down meanwhile
+                return
+            self._workers.remove(worker)
+            new_worker = RenderWorker(self._context)
+            self._workers.append(new_worker)
+
+        self._idle.put(new_worker)
+
+
+RENDER_POOL = RenderPool()
+
+atexit.register(RENDER_POOL.shutdown)
@@ -20,7 +20,7 @@ except IndexError:
 from kinobot.comments import collect
 from kinobot.db import update_library, generate_static_poster_collages
 from kinobot.discord_bot import discord_bot
-from kinobot.post import publish, testing
+from kinobot.post import prerender_requests, publish, testing
 
 
 @click.group()
@@ -34,6 +34,7 @@ for command in (
     update_library,
     generate_static_poster_collages,
     publish,
+    prerender_requests,
     testing,
 ):
     cli.add_command(command)
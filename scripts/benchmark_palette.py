@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Compare the latency of the palette engines from kinobot.palette
+
+import argparse
+import logging
+import os
+import sys
+import time
+
+import numpy as np
+from PIL import Image
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+# kinobot exits without its configuration, but the palette engines don't use
+# it. Placeholders are only set for missing variables.
+for var in (
+    "FACEBOOK",
+    "FACEBOOK_TV",
+    "FILM_COLLECTION",
+    "EPISODE_COLLECTION",
+    "FRAMES_DIR",
+    "NSFW_MODEL",
+    "FONTS",
+    "TMDB",
+    "RANDOMORG",
+    "RADARR",
+    "RADARR_URL",
+    "REQUESTS_JSON",
+    "OFFENSIVE_JSON",
+    "KINOBASE",
+    "REQUESTS_DB",
+    "DISCORD_WEBHOOK",
+    "DISCORD_WEBHOOK_TEST",
+    "DISCORD_TOKEN",
+    "DISCORD_DB",
+    "PLEX_URL",
+    "PLEX_TOKEN",
+    "PLEX_ACCOUNT_ID",
+    "KINOLOG",
+    "KINOLOG_COMMENTS",
+    "KINOBOT_ID",
+    "KINOSONGS",
+    "MEME_IMG",
+):
+    os.environ.setdefault(var, "")
+
+from kinobot.palette import COLOR_ENGINES
+
+SIZES = {"1080p": (1920, 1080), "4K": (3840, 2160)}
+
+parser = argparse.ArgumentParser(description="Benchmark palette engines.")
+parser.add_argument("-i", metavar="IMAGE", help="frame (random noise if missing)")
+parser.add_argument("-r", metavar="RUNS", type=int, default=10, help="runs")
+parser.add_argument(
+    "-e",
+    metavar="ENGINE",
+    action="append",
+    choices=list(COLOR_ENGINES),
+    help="engine (default: all)",
+)
+args = parser.parse_args()
+
+logging.basicConfig(level=logging.WARNING)
+
+
+def get_image(size):
+    if args.i:
+        return Image.open(args.i).convert("RGB").resize(size)
+
+    # Smooth noise looks more like a frame than plain noise
+    rng = np.random.default_rng(42)
+    small = rng.integers(0, 256, (size[1] // 40, size[0] // 40, 3), dtype=np.uint8)
+    return Image.fromarray(small).resize(size, Image.BICUBIC)
+
+
+def benchmark(func, image):
+    func(image)  # warm up
+    times = []
+    for _ in range(args.r):
+        start = time.perf_counter()
+        func(image)
+        times.append(time.perf_counter() - start)
+
+    return np.median(times) * 1000, np.max(times) * 1000
+
+
+for name, size in SIZES.items():
+    image = get_image(size)
+    for engine in args.e or COLOR_ENGINES:
+        try:
+            median, worst = benchmark(COLOR_ENGINES[engine], image)
+        except Exception as error:
+            print(f"{name}\t{engine}\tfailed: {error}")
+            continue
+        print(f"{name}\t{engine}\tmedian: {median:.1f} ms\tmax: {worst:.1f} ms")
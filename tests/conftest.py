@@ -0,0 +1,52 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# kinobot exits if its configuration is missing. Tests only need writable
+# paths, so everything points to a throwaway directory.
+TEST_DIR = tempfile.mkdtemp(prefix="kinobot-tests-")
+ENV_VARS = (
+    "FACEBOOK",
+    "FACEBOOK_TV",
+    "FILM_COLLECTION",
+    "EPISODE_COLLECTION",
+    "NSFW_MODEL",
+    "TMDB",
+    "RANDOMORG",
+    "RADARR",
+    "RADARR_URL",
+    "REQUESTS_JSON",
+    "OFFENSIVE_JSON",
+    "DISCORD_WEBHOOK",
+    "DISCORD_WEBHOOK_TEST",
+    "DISCORD_TOKEN",
+    "PLEX_URL",
+    "PLEX_TOKEN",
+    "PLEX_ACCOUNT_ID",
+    "KINOLOG",
+    "KINOLOG_COMMENTS",
+    "KINOBOT_ID",
+    "KINOSONGS",
+    "MEME_IMG",
+)
+
+for var in ENV_VARS:
+    os.environ.setdefault(var, os.path.join(TEST_DIR, var.lower()))
+
+os.environ["KINOBASE"] = os.path.join(TEST_DIR, "kinobase.db")
+os.environ["REQUESTS_DB"] = os.path.join(TEST_DIR, "requests.db")
+os.environ["DISCORD_DB"] = os.path.join(TEST_DIR, "discord.db")
+os.environ["FRAMES_DIR"] = os.path.join(TEST_DIR, "frames")
+os.environ["FONTS"] = os.path.join(os.path.dirname(__file__), "..", "kinobot", "fonts")
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+
+@pytest.fixture(scope="session")
+def kinobase():
+    from kinobot.db import create_db_tables
+
+    create_db_tables()
+    return os.environ["KINOBASE"]
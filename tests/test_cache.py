@@ -0,0 +1,42 @@
+import os
+
+import numpy as np
+
+from kinobot.cache import ArrayCache
+
+
+def test_array_cache(tmp_path):
+    cache = ArrayCache("test", 3 * 1024 * 1024)
+    cache.directory = str(tmp_path)
+    frame = np.arange(720 * 1280 * 3, dtype=np.uint64).astype(np.uint8)
+
+    assert cache.get(("movie", 1)) is None
+    cache.put(("movie", 1), frame)
+    assert np.array_equal(cache.get(("movie", 1)), frame)
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_array_cache_eviction(tmp_path):
+    cache = ArrayCache("test", 3 * 1024 * 1024)
+    cache.directory = str(tmp_path)
+    frame = np.zeros((720, 1280, 3), dtype=np.uint8)
+
+    for number in range(3):
+        cache.put(("movie", number), frame)
+        os.utime(cache._get_path(("movie", number)), (number, number))
+
+    # least recently used first
+    assert cache.get(("movie", 0)) is None
+    assert cache.get(("movie", 2)) is not None
+
+
+def test_array_cache_mmap(tmp_path):
+    cache = ArrayCache("test", 3 * 1024 * 1024)
+    cache.directory = str(tmp_path)
+    frame = np.full((90, 160, 3), 7, dtype=np.uint8)
+
+    cache.put(("movie", 1), frame)
+    cached = cache.get(("movie", 1), "r")
+
+    assert isinstance(cached, np.memmap)
+    assert np.array_equal(cached, frame)
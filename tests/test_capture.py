@@ -0,0 +1,81 @@
+import threading
+
+import cv2
+import numpy as np
+import pytest
+
+from kinobot.capture import CapturePool
+
+
+@pytest.fixture
+def videos(tmp_path):
+    paths = []
+    for number in range(3):
+        path = str(tmp_path / f"{number}.avi")
+        writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"MJPG"), 24, (64, 48))
+        for _ in range(5):
+            writer.write(np.full((48, 64, 3), number * 50, dtype=np.uint8))
+        writer.release()
+        paths.append(path)
+
+    return paths
+
+
+def test_reuse(videos):
+    pool = CapturePool(max_size=2)
+    with pool.acquire(videos[0]) as first:
+        pass
+    with pool.acquire(videos[0]) as second:
+        assert first is second
+
+    pool.release()
+    assert not len(pool)
+
+
+def test_eviction_keeps_handles_in_use(videos):
+    pool = CapturePool(max_size=1)
+
+    with pool.acquire(videos[0]) as capture:
+        # Evicts the first capture while it's still in use
+        with pool.acquire(videos[1]):
+            pass
+
+        assert videos[0] not in pool
+        assert capture.isOpened()
+        assert capture.read()[0]
+
+    assert not capture.isOpened()
+    pool.release()
+
+
+def test_release_waits_for_holders(videos):
+    pool = CapturePool()
+    reading = threading.Event()
+    released = threading.Event()
+    results = []
+
+    def reader():
+        with pool.acquire(videos[0]) as capture:
+            reading.set()
+            released.wait(5)
+            results.append(capture.read()[0])
+
+    thread = threading.Thread(target=reader)
+    thread.start()
+    reading.wait(5)
+    pool.release(videos[0])
+    released.set()
+    thread.join()
+
+    assert results == [True]
+    assert videos[0] not in pool
+
+
+def test_failed_handle_is_released(videos):
+    pool = CapturePool()
+    with pytest.raises(ValueError):
+        with pool.acquire(videos[0]) as capture:
+            raise ValueError
+
+    assert videos[0] not in pool
+    assert not capture.isOpened()
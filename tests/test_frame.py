@@ -0,0 +1,142 @@
+import shutil
+
+import cv2
+import numpy as np
+import pytest
+
+from kinobot import frame
+from kinobot.frame import (
+    TRIM_BACKGROUND,
+    TRIM_FUZZ,
+    crop_box_to_str,
+    fix_frame,
+    get_frames_from_ffmpeg,
+    get_frames_from_movie,
+    get_trim_box,
+    parse_crop_box,
+)
+
+
+@pytest.fixture
+def video(tmp_path):
+    path = str(tmp_path / "video.avi")
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"MJPG"), 24, (320, 240))
+    for number in range(48):
+        writer.write(np.full((240, 320, 3), number * 5, dtype=np.uint8))
+    writer.release()
+    return path
+
+
+@pytest.mark.skipif(shutil.which("ffmpeg") is None, reason="ffmpeg not found")
+@pytest.mark.parametrize("max_height", [None, 120])
+def test_backend_geometry(video, max_height):
+    timestamps = [(0, 0), (1, 0)]
+    opencv = get_frames_from_movie(video, timestamps, max_height=max_height)
+    ffmpeg = get_frames_from_ffmpeg(video, timestamps, max_height=max_height)
+
+    assert [frame.shape for frame in opencv] == [frame.shape for frame in ffmpeg]
+
+
+def test_crop_box_to_str():
+    assert crop_box_to_str((0, 0.125, 1, 0.875)) == "0.00000,0.12500,1.00000,0.87500"
+    assert parse_crop_box(crop_box_to_str((0, 0.125, 1, 0.875))) == (0, 0.125, 1, 0.875)
+    assert crop_box_to_str((0, 0.125, 1, 0.875), stable=False) == "unstable"
+    assert parse_crop_box("unstable") is None
+    # Nothing detected: stored as NULL and retried
+    assert crop_box_to_str(None, False) is None
+
+
+def get_sample_frames():
+    rng = np.random.default_rng(0)
+    content = rng.integers(1, 256, (180, 320, 3), dtype=np.uint8)
+
+    letterbox = content.copy()
+    letterbox[:22], letterbox[-22:] = 0, 0
+
+    pillarbox = content.copy()
+    pillarbox[:, :40], pillarbox[:, -40:] = 0, 0
+
+    # edges partially covered by black (logos, dark scenes)
+    partial = letterbox.copy()
+    partial[22:30, :100] = 0
+    partial[60:80, -60:] = 0
+
+    dark = rng.integers(0, 3, (180, 320, 3), dtype=np.uint8)
+    dark[:, :30] = 0
+
+    return [content, letterbox, pillarbox, partial, dark]
+
+
+@pytest.mark.parametrize("index", range(len(get_sample_frames())))
+def test_trim_box_matches_wand(index):
+    wand_image = pytest.importorskip("wand.image")
+
+    frame = get_sample_frames()[index]
+    with wand_image.Image.from_array(frame[..., ::-1].copy()) as image:
+        image.trim(color="black", fuzz=TRIM_FUZZ, percent_background=TRIM_BACKGROUND)
+        expected = (
+            image.page_x,
+            image.page_y,
+            image.page_x + image.width,
+            image.page_y + image.height,
+        )
+
+    assert get_trim_box(frame) == expected
+
+
+def test_trim_box():
+    letterbox, pillarbox, partial = get_sample_frames()[1:4]
+
+    assert get_trim_box(letterbox) == (0, 22, 320, 158)
+    assert get_trim_box(pillarbox) == (40, 0, 280, 180)
+    # rows with more than 20% of black pixels are trimmed too
+    assert get_trim_box(partial) == (0, 30, 320, 158)
+    # nothing but black pixels is background
+    assert get_trim_box(letterbox + 1) == (0, 0, 320, 180)
+    assert get_trim_box(np.zeros_like(letterbox)) == (0, 0, 320, 180)
+
+
+def test_fix_frame():
+    letterbox = get_sample_frames()[1]
+
+    # 4:3 anamorphic frame
+    assert fix_frame("video.mkv", letterbox, 4 / 3).size == (240, 136)
+    # a stored crop box replaces the trim
+    image = fix_frame("video.mkv", letterbox, 4 / 3, (0, 0, 1, 0.75))
+    assert image.size == (240, 135)
+    # too wide frames are center cropped
+    image = fix_frame("video.mkv", letterbox, 320 / 180)
+    assert image.size == (258, 136)
+
+
+def test_post_process_frame(monkeypatch):
+    image = fix_frame("video.mkv", get_sample_frames()[1], 4 / 3)
+
+    def analyze_frame(rgb_array):
+        raise AssertionError("analyze_frame called")
+
+    # collages don't need palettes
+    with monkeypatch.context() as context:
+        context.setattr(frame, "analyze_frame", analyze_frame)
+        assert frame.post_process_frame(image, multiple=True) is image
+
+    colors = []
+
+    def get_palette(image, engine=None, analysis=None):
+        colors.append(analysis.palette_colors)
+        return image
+
+    monkeypatch.setattr(frame, "get_palette", get_palette)
+    frame.post_process_frame(image)
+    assert len(colors[0]) == 10
+
+
+def test_analyze_frame():
+    gray = np.full((200, 1000, 3), 128, dtype=np.uint8)
+    gray[:, 500:] = 20
+    analysis = frame.analyze_frame(gray)
+
+    assert analysis.bw
+    assert set(analysis.palette_colors) == {(20, 20, 20), (128, 128, 128)}
+    # other engines extract colors from the full frame
+    assert frame.analyze_frame(gray, "wand").palette_colors is None
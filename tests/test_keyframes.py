@@ -0,0 +1,28 @@
+import os
+
+import numpy as np
+
+from kinobot.keyframes import FrameIndex, get_frame_index, insert_frame_index
+
+
+def test_get_frame_index(kinobase, tmp_path):
+    path = str(tmp_path / "video.mkv")
+    with open(path, "wb") as f:
+        f.write(b"video")
+
+    # Misses are not cached
+    assert get_frame_index(path) is None
+
+    frame_index = FrameIndex(
+        np.arange(0, 10000, 1000, dtype=np.int64), np.array([0, 5], dtype=np.int64)
+    )
+    insert_frame_index(path, frame_index)
+    loaded = get_frame_index(path)
+    assert np.array_equal(loaded.pts, frame_index.pts)
+    assert np.array_equal(loaded.keyframes, frame_index.keyframes)
+
+    # The stored index belongs to the old file
+    with open(path, "wb") as f:
+        f.write(b"replaced video")
+    os.utime(path, (1, 1))
+    assert get_frame_index(path) is None
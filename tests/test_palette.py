@@ -0,0 +1,51 @@
+import numpy as np
+from PIL import Image
+
+from kinobot.frame import FrameAnalysis
+from kinobot.palette import clean_colors, get_colors_numpy, get_palette, median_cut
+
+
+def test_median_cut():
+    pixels = np.zeros((10, 10, 3), dtype=np.uint8)
+    pixels[:, :5] = (200, 10, 10)
+    pixels[:, 5:] = (10, 10, 200)
+
+    # sorted by luminance, dark first
+    assert median_cut(pixels, 2) == [(10, 10, 200), (200, 10, 10)]
+    # no more colors than the image has
+    assert median_cut(pixels, 10) == [(10, 10, 200), (200, 10, 10)]
+
+
+def test_get_colors_numpy():
+    rng = np.random.default_rng(0)
+    image = Image.fromarray(rng.integers(0, 256, (300, 500, 3), dtype=np.uint8))
+
+    colors = get_colors_numpy(image)
+    assert len(colors) == 10
+    assert colors == get_colors_numpy(image)
+
+    luminance = [np.dot(color, (0.299, 0.587, 0.114)) for color in colors]
+    assert luminance == sorted(luminance)
+
+
+def test_clean_colors():
+    colors = [(10 * i, 10 * i, 10 * i) for i in range(5)]
+    assert clean_colors(colors) is None
+
+    colors += [(100, 100, 100), (200, 200, 200), (250, 250, 250)]
+    assert clean_colors(colors) == colors[:6]
+
+
+def test_get_palette_analysis():
+    # a single color image has no palette of its own
+    image = Image.new("RGB", (400, 200), (40, 60, 80))
+    colors = [(value, value, value) for value in range(0, 100, 10)]
+    analysis = FrameAnalysis(bw=False, palette_colors=colors)
+
+    assert get_palette(image, engine="numpy").size == image.size
+
+    result = get_palette(image, engine="numpy", analysis=analysis)
+    assert result.getpixel((0, result.height - 1)) == (0, 0, 0)
+    # analysis colors are only reused by the numpy engine
+    result = get_palette(image, engine="alt", analysis=analysis)
+    assert result.getpixel((0, result.height - 1)) != (0, 0, 0)
@@ -0,0 +1,73 @@
+import time
+
+import pytest
+
+from kinobot import exceptions, post
+
+
+class FakeRequest:
+    """
+    request.Request stand-in: frames named "fail" can't be dispatched.
+    """
+
+    finished = []
+
+    def __init__(self, content, movies, episodes, req_dictionary, multiple=False):
+        self.content = content
+        self.is_minute = True
+
+    def handle_minute_request(self):
+        if self.content == "fail":
+            raise exceptions.InvalidRequest(self.content)
+
+    def finish(self, record=True):
+        self.finished.append((self.content, record))
+
+
+@pytest.fixture
+def fake_request(monkeypatch):
+    monkeypatch.setattr(post, "Request", FakeRequest)
+    monkeypatch.setattr(post, "get_list_of_movie_dicts", lambda: [])
+    monkeypatch.setattr(post, "get_list_of_episode_dicts", lambda: [])
+    FakeRequest.finished = []
+    return FakeRequest
+
+
+def test_dispatch_failure_records_previous_frames(fake_request):
+    comment_dict = {"content": ["first", "second", "fail", "last"]}
+
+    with pytest.raises(exceptions.InvalidRequest):
+        list(post.generate_frames(comment_dict, record=False))
+
+    assert fake_request.finished == [("first", False), ("second", False)]
+
+
+def test_generate_frames(fake_request):
+    comment_dict = {"content": ["first", "second"]}
+
+    assert len(list(post.generate_frames(comment_dict))) == 2
+    assert fake_request.finished == [("first", True), ("second", True)]
+
+
+def test_staged_request_resting(monkeypatch):
+    movie = {
+        "title": "Stalker",
+        "original_title": "Сталкер",
+        "year": 1979,
+        "last_request": int(time.time()),
+    }
+    claimed = []
+    monkeypatch.setattr(post, "get_list_of_movie_dicts", lambda: [movie])
+    monkeypatch.setattr(post, "claim_staged_request", lambda *args: claimed.append(1))
+    request_dict = {
+        "id": "1",
+        "movie": "Stalker 1979",
+        "parallel": None,
+        "is_episode": False,
+    }
+
+    with pytest.raises(exceptions.RestingMovie):
+        post.publish_staged_images(request_dict, {"movie": movie})
+
+    # the staged result is kept
+    assert not claimed
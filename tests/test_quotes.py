@@ -0,0 +1,70 @@
+import os
+import sqlite3
+from datetime import timedelta
+
+import srt
+
+from kinobot.quotes import (
+    get_match_queries,
+    index_subtitle,
+    search_quotes,
+    update_quote_index,
+)
+
+
+def write_subtitle(path, contents):
+    subtitles = [
+        srt.Subtitle(
+            index + 1,
+            timedelta(seconds=index * 3),
+            timedelta(seconds=index * 3 + 2),
+            content,
+        )
+        for index, content in enumerate(contents)
+    ]
+    with open(path, "w") as f:
+        f.write(srt.compose(subtitles))
+
+
+def test_get_match_queries():
+    assert get_match_queries("Hello, there!") == ['"hello there"', '"hello" "there"']
+    assert get_match_queries("Hello") == ['"hello"']
+    assert get_match_queries("...") == []
+
+
+def test_quote_index(kinobase, tmp_path):
+    first, second = str(tmp_path / "first.srt"), str(tmp_path / "second.srt")
+    write_subtitle(first, ["Hello there.", "<i>General Kenobi.</i>"])
+    write_subtitle(second, ["There is no general here.", "Qué pasó, señor?"])
+    movies = [
+        {"tmdb": "1", "subtitle": first},
+        {"tmdb": "2", "subtitle": second},
+        {"tmdb": "3", "subtitle": str(tmp_path / "missing.srt")},
+    ]
+    update_quote_index(movies)
+
+    match = search_quotes("general kenobi")[0]
+    assert (match.item_type, match.item_id) == ("movies", "1")
+    assert (match.index, match.start, match.end) == (2, 3000, 5000)
+    assert match.quote == "General Kenobi."
+
+    # every word, in any order
+    assert {match.item_id for match in search_quotes("general there")} == {"2"}
+    # diacritics are ignored
+    assert search_quotes("que paso senor")[0].item_id == "2"
+    assert search_quotes("nothing like this") == []
+
+    with sqlite3.connect(kinobase) as conn:
+        # unchanged files are skipped
+        assert not index_subtitle(conn, "movies", "1", first)
+
+        write_subtitle(first, ["Hello again."])
+        os.utime(first, (1, 1))
+        assert index_subtitle(conn, "movies", "1", first)
+
+    assert search_quotes("general kenobi") == []
+    assert search_quotes("hello again")[0].item_id == "1"
+
+    # subtitles of removed movies are removed
+    update_quote_index(movies[:1])
+    assert search_quotes("general here") == []
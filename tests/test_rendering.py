@@ -0,0 +1,20 @@
+import os
+
+from kinobot.rendering import get_text_layout, wrap_text
+
+FONT = os.path.join(os.environ["FONTS"], "helvetica.ttf")
+
+
+def test_wrap_text():
+    assert wrap_text("Hello  there.\nGeneral   Kenobi.", 45) == (
+        "Hello there.\nGeneral Kenobi."
+    )
+    assert wrap_text("word " * 20, 45).count("\n") == 2
+    assert wrap_text("one\ntwo\nthree", 45) == "one two three"
+
+
+def test_get_text_layout():
+    layout = get_text_layout("Hello there.", FONT, 20)
+    assert layout.text == "Hello there."
+    assert layout.size[0] > layout.size[1] > 0
+    assert get_text_layout("Hello there.", FONT, 20) is layout
@@ -0,0 +1,234 @@
+import os
+import random
+from datetime import timedelta
+
+import pytest
+import srt
+from fuzzywuzzy import process
+
+from kinobot import exceptions
+from kinobot.request import find_quote, guess_subtitle_chain, to_dict
+from kinobot.subtitles import get_subtitles
+from kinobot.utils import check_chain_integrity, normalize_request_str
+
+LICENSE = os.path.join(os.path.dirname(__file__), "..", "LICENSE")
+
+
+def find_quote_full_scan(subtitle_list, quote):
+    """
+    find_quote before the trigram shortlist: every line is scored.
+    """
+    for sub in subtitle_list:
+        if normalize_request_str(quote, False) == normalize_request_str(
+            sub.content, False
+        ):
+            return to_dict(sub)
+
+    contents = [sub.content for sub in subtitle_list]
+    final_strings = process.extract(quote, contents, limit=5)
+    cleaned_request = normalize_request_str(quote)
+    cleaned_quote = normalize_request_str(final_strings[0][0])
+    difference = abs(len(cleaned_request) - len(cleaned_quote))
+
+    if final_strings[0][1] < 87 or difference >= 2:
+        raise exceptions.QuoteNotFound(quote)
+
+    return to_dict(subtitle_list[contents.index(final_strings[0][0])])
+
+
+def check_perfect_chain_old(request_list, subtitle_list):
+    """
+    Perfect chain lookup before the normalized text indices.
+    """
+    request_list = [normalize_request_str(req) for req in request_list]
+    hits, index_list = 0, []
+    for subtitle in subtitle_list:
+        if request_list[0] != normalize_request_str(subtitle.content):
+            continue
+        loop_hits = [subtitle.index - 1]
+        inc = 1
+        while True:
+            try:
+                subtitle_ = subtitle_list[subtitle.index + inc - 1]
+                if request_list[inc] != normalize_request_str(subtitle_.content):
+                    break
+            except IndexError:
+                break
+            loop_hits.append(subtitle.index + inc - 1)
+            inc += 1
+        if len(loop_hits) > hits:
+            hits, index_list = len(loop_hits), loop_hits
+
+    return [subtitle_list[index] for index in index_list] if hits > 1 else []
+
+
+def guess_subtitle_chain_old(subtitle_list, content):
+    """
+    guess_subtitle_chain before the normalized text indices.
+    """
+    perfect_chain = check_perfect_chain_old(content, subtitle_list)
+    if len(perfect_chain) == len(content):
+        return [to_dict(chain) for chain in perfect_chain]
+
+    first_index = find_quote_full_scan(subtitle_list, content[0])["index"]
+    chain_list = [
+        to_dict(subtitle_list[i])
+        for i in range(first_index - 1, first_index + len(content) - 1)
+    ]
+    try:
+        check_chain_integrity(content, [i["message"] for i in chain_list])
+        return chain_list
+    except exceptions.InconsistentSubtitleChain:
+        return None
+
+
+def get_key(quote_dict):
+    if quote_dict is None:
+        return None
+
+    return tuple(quote_dict[key] for key in ("start", "start_m", "end", "end_m"))
+
+
+def get_queries(lines, rng):
+    for line in rng.sample(lines, 30):
+        words = line.split()
+        yield line
+        yield line.upper()
+        # typos
+        position = rng.randrange(len(line))
+        yield line[:position] + line[position + 1 :]
+        yield line[:position] + "x" + line[position:]
+        # missing and extra words
+        if len(words) > 3:
+            yield " ".join(words[1:])
+            yield " ".join(words[:-1])
+        yield line + " " + rng.choice(words)
+
+    # words of different lines
+    for _ in range(20):
+        yield " ".join(rng.sample(rng.choice(lines).split(), 2) + ["the"])
+
+
+def get_license_lines():
+    with open(LICENSE) as f:
+        lines = [" ".join(line.split()) for line in f]
+
+    return [line for line in lines if len(line) > 10]
+
+
+def write_subtitle(path, lines):
+    subtitles = [
+        srt.Subtitle(
+            index + 1,
+            timedelta(seconds=index * 2),
+            timedelta(seconds=index * 2 + 1),
+            line,
+        )
+        for index, line in enumerate(lines)
+    ]
+    with open(path, "w") as f:
+        f.write(srt.compose(subtitles))
+
+    return path
+
+
+@pytest.fixture(scope="module")
+def subtitle_path(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp("subtitles") / "license.srt")
+    return write_subtitle(path, get_license_lines()[:800])
+
+
+@pytest.fixture(scope="module")
+def chain_path(tmp_path_factory):
+    lines = get_license_lines()[:300]
+    # repeated (and partially repeated) chains
+    lines = lines[:100] + lines[20:24] + lines[100:200] + lines[20:26] + lines[200:]
+    path = str(tmp_path_factory.mktemp("subtitles") / "chains.srt")
+    return write_subtitle(path, lines)
+
+
+def test_find_quote_matches_full_scan(subtitle_path):
+    with open(subtitle_path) as f:
+        subtitles = list(srt.parse(f))
+    store = get_subtitles(subtitle_path)
+    lines = [subtitle.content for subtitle in subtitles]
+
+    checked = 0
+    for quote in get_queries(lines, random.Random(0)):
+        if len(quote) <= 2 or len(quote) > 130:
+            continue
+        try:
+            expected = find_quote_full_scan(subtitles, quote)
+        except exceptions.QuoteNotFound:
+            expected = None
+        try:
+            found = find_quote(store, quote)
+        except exceptions.QuoteNotFound:
+            found = None
+
+        # timestamps identify the line
+        assert get_key(found) == get_key(expected), quote
+        checked += 1
+
+    assert checked > 200
+
+
+def test_find_quote_not_found(subtitle_path):
+    store = get_subtitles(subtitle_path)
+
+    with pytest.raises(exceptions.QuoteNotFound):
+        find_quote(store, "Hello there. General Kenobi.")
+
+    with pytest.raises(exceptions.InvalidRequest):
+        find_quote(store, "Hi")
+
+
+def get_chains(lines, rng):
+    for _ in range(60):
+        length = rng.randint(2, 5)
+        start = rng.randrange(len(lines) - length)
+        chain = lines[start : start + length]
+        yield chain
+        yield [line.lower() for line in chain]
+        # broken chains
+        yield chain[:-1] + [rng.choice(lines)]
+        yield [rng.choice(lines)] + chain[1:]
+        yield chain[::-1]
+        yield chain[:1] + [chain[0] + " and more words"]
+
+    # repeated chains
+    yield lines[20:24]
+    yield lines[20:26]
+    yield lines[22:25]
+
+
+def test_guess_subtitle_chain_matches_old(chain_path):
+    with open(chain_path) as f:
+        subtitles = list(srt.parse(f))
+    store = get_subtitles(chain_path)
+    lines = [subtitle.content for subtitle in subtitles]
+
+    for content in get_chains(lines, random.Random(0)):
+        try:
+            expected = guess_subtitle_chain_old(subtitles, content)
+        except (exceptions.QuoteNotFound, IndexError) as error:
+            expected = type(error)
+        try:
+            found = guess_subtitle_chain(store, {"content": content})
+        except (exceptions.QuoteNotFound, IndexError) as error:
+            found = type(error)
+
+        if isinstance(expected, list):
+            assert [get_key(item) for item in found] == [
+                get_key(item) for item in expected
+            ], content
+        else:
+            assert found == expected, content
+
+
+def test_guess_subtitle_chain_skips(chain_path):
+    store = get_subtitles(chain_path)
+    line = store[0].content
+
+    assert guess_subtitle_chain(store, {"content": [line]}) is None
+    assert guess_subtitle_chain(store, {"content": [line, "1:10"]}) is None
@@ -0,0 +1,112 @@
+import os
+from datetime import timedelta
+
+import pytest
+import srt
+from fuzzywuzzy.utils import full_process
+
+from kinobot.subtitles import (
+    compile_subtitle,
+    get_subtitles,
+    has_dialogue,
+    is_compiled,
+)
+from kinobot.utils import normalize_request_str
+
+CONTENTS = [
+    "Hello there.",
+    "<i>General Kenobi.</i>",
+    "- You are a bold one.\n- Kill him!",
+    "Ñandú, café y acción.",
+    "Hello there.",
+]
+
+
+def write_subtitle(path, contents):
+    subtitles = [
+        srt.Subtitle(
+            index + 1,
+            timedelta(seconds=index * 3, microseconds=250000),
+            timedelta(seconds=index * 3 + 2),
+            content,
+        )
+        for index, content in enumerate(contents)
+    ]
+    with open(path, "w") as f:
+        f.write(srt.compose(subtitles))
+
+
+def get_fields(subtitle):
+    return subtitle.index, subtitle.start, subtitle.end, subtitle.content
+
+
+@pytest.fixture
+def subtitle_path(tmp_path):
+    path = str(tmp_path / "movie.srt")
+    write_subtitle(path, CONTENTS)
+    return path
+
+
+def test_store_matches_srt(subtitle_path):
+    with open(subtitle_path) as f:
+        parsed = list(srt.parse(f))
+    store = get_subtitles(subtitle_path)
+
+    assert len(store) == len(parsed)
+    assert [get_fields(subtitle) for subtitle in store] == list(map(get_fields, parsed))
+    for subtitle, expected in zip(store, parsed):
+        assert subtitle.clean == normalize_request_str(expected.content, False)
+        assert subtitle.dialogue == has_dialogue(expected.content)
+
+    assert get_fields(store[-1]) == get_fields(parsed[-1])
+    assert list(map(get_fields, store[1:3])) == list(map(get_fields, parsed[1:3]))
+    assert store.get_texts("fuzzy") == [
+        full_process(subtitle.content, force_ascii=True) for subtitle in parsed
+    ]
+
+
+def test_get_positions(subtitle_path):
+    store = get_subtitles(subtitle_path)
+
+    assert store.get_positions(normalize_request_str("Hello there.", False)) == [0, 4]
+    assert store.get_positions("hello there.") == []
+    assert store.get_positions(normalize_request_str("Hello there."), True) == [0, 4]
+
+
+def test_get_candidates(subtitle_path):
+    store = get_subtitles(subtitle_path)
+
+    candidates = store.get_candidates(full_process("general kenobi", True))
+    assert 1 in candidates
+    assert candidates == sorted(candidates)
+    assert store.get_candidates("zzzz") == []
+
+
+def test_get_length_positions(subtitle_path):
+    store = get_subtitles(subtitle_path)
+    length = len(normalize_request_str("Hello there."))
+
+    assert store.get_length_positions(length) == [0, 4]
+    assert store.get_length_positions(length, 0) == [0, 4]
+    assert store.get_length_positions(100) == []
+
+
+def test_recompile(subtitle_path):
+    assert get_subtitles(subtitle_path)[0].content == "Hello there."
+
+    write_subtitle(subtitle_path, ["Another movie."] * 2)
+    os.utime(subtitle_path, (1, 1))
+    assert not is_compiled(subtitle_path)
+
+    store = get_subtitles(subtitle_path)
+    assert is_compiled(subtitle_path)
+    assert [subtitle.content for subtitle in store] == ["Another movie."] * 2
+
+
+def test_empty_subtitle(tmp_path):
+    path = str(tmp_path / "empty.srt")
+    open(path, "w").close()
+    compile_subtitle(path)
+
+    assert len(get_subtitles(path)) == 0
+    assert get_subtitles(path).get_candidates("hello") == []
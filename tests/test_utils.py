@@ -0,0 +1,15 @@
+import numpy as np
+import pytest
+
+from kinobot.utils import array_to_wand, wand_to_array
+
+
+def test_wand_round_trip():
+    pytest.importorskip("wand.image")
+    array = np.random.default_rng(0).integers(0, 256, (90, 160, 3), dtype=np.uint8)
+
+    with array_to_wand(array) as magick:
+        assert magick.size == (160, 90)
+        # RGB arrays make opaque images
+        assert set(magick.export_pixels(channel_map="A")) == {255}
+        assert np.array_equal(wand_to_array(magick), array)
@@ -0,0 +1,74 @@
+import os
+import time
+
+import pytest
+from PIL import Image
+from timeout_decorator import timeout_decorator
+
+import kinobot
+from kinobot.workers import RenderPool, export_settings
+
+
+def make_images(count):
+    return [Image.new("RGB", (16, 9), (number, 0, 0)) for number in range(count)]
+
+
+def fail():
+    raise ValueError("failed")
+
+
+@pytest.fixture
+def pool():
+    pool = RenderPool(2, preload=())
+    yield pool
+    pool.shutdown()
+
+
+def test_run(pool):
+    images = pool.run(make_images, (3,))
+    assert [image.getpixel((0, 0)) for image in images] == [
+        (0, 0, 0),
+        (1, 0, 0),
+        (2, 0, 0),
+    ]
+
+    with pytest.raises(ValueError):
+        pool.run(fail)
+
+    # workers survive task errors
+    assert pool.run(make_images, (1,))[0].size == (16, 9)
+
+
+def test_submit(pool):
+    futures = [pool.submit(make_images, (count,)) for count in range(1, 5)]
+    assert [len(future.result()) for future in futures] == [1, 2, 3, 4]
+    assert len(pool._workers) <= 2
+
+
+def test_timeout(pool):
+    with pytest.raises(timeout_decorator.TimeoutError):
+        pool.run(time.sleep, (5,), timeout=0.5)
+
+    # the worker was replaced
+    assert len(pool.run(make_images, (2,))) == 2
+
+
+def test_submit_after(pool):
+    first = pool.submit(make_images, (1,))
+    second = pool.submit_after(first, make_images, (2,))
+    assert len(second.result()) == 2
+
+    failed = pool.submit(fail)
+    chained = pool.submit_after(failed, make_images, (2,))
+    with pytest.raises(ValueError):
+        chained.result()
+
+
+def test_export_settings(monkeypatch):
+    # run.py patches these in test mode
+    monkeypatch.setenv("KINOBASE", kinobot.KINOBASE)
+    monkeypatch.setattr(kinobot, "KINOBASE", kinobot.KINOBASE + ".save")
+
+    export_settings()
+
+    assert os.environ["KINOBASE"] == kinobot.KINOBASE